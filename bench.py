@@ -0,0 +1,319 @@
+#!/usr/bin/env python2
+'''
+PushyBullet benchmarks
+
+Usage: bench.py [benchmark ...]
+
+Runs all benchmarks (or only given ones) and prints results as JSON.
+Network benchmarks run against a local fake API server (see fakeserver.py).
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import itertools
+import platform
+import tempfile
+import multiprocessing
+from StringIO import StringIO
+
+import pushybullet as pb
+from fakeserver import FakeServer, FakeStream
+
+
+def sample_push(n):
+    '''
+    Raw note push data as returned by PushBullet API
+    '''
+    return {
+            'iden': 'ujpah72o0sjAoRtnM0jc%06d' % n,
+            'type': 'note',
+            'active': True,
+            'dismissed': False,
+            'created': 1400000000.0 + n,
+            'modified': 1400000000.0 + n,
+            'direction': 'self',
+            'sender_iden': 'ujpah72o0',
+            'sender_email': 'elon@teslamotors.com',
+            'sender_email_normalized': 'elon@teslamotors.com',
+            'sender_name': 'Elon Musk',
+            'receiver_iden': 'ujpah72o0',
+            'receiver_email': 'elon@teslamotors.com',
+            'receiver_email_normalized': 'elon@teslamotors.com',
+            'target_device_iden': 'ujpah72o0sjAoRtnM0jc',
+            'source_device_iden': 'ujpah72o0sjAoRtnM0jd',
+            'title': 'Space Travel Ideas',
+            'body': 'Space Elevator, Mars Hyperloop, Space Model S (Model Space?)',
+            }
+
+
+class DictPush(object):
+    '''
+    Push object storing fields in per-instance `__dict__` (for comparison)
+    '''
+    def __init__(self, **data):
+        self.__dict__.update(data)
+
+
+def object_size(obj):
+    '''
+    Memory used by object itself and its fields containers (not counting field values)
+    '''
+    size = sys.getsizeof(obj)
+    for container in (getattr(obj, '__dict__', None), getattr(obj, '_extra', None)):
+        if container is not None:
+            size += sys.getsizeof(container)
+    return size
+
+
+def bench_push_memory(count=100000):
+    api = pb.PushBullet('')
+    data = [sample_push(n) for n in xrange(count)]
+
+    started = time.time()
+    pushes = [api.make_push(dict(d)) for d in data]
+    elapsed = time.time() - started
+
+    slots_size = sum(object_size(p) for p in pushes)
+    dict_size = sum(object_size(DictPush(**d)) for d in data)
+
+    return {
+            'count': count,
+            'dict_bytes_per_push': dict_size / float(count),
+            'slots_bytes_per_push': slots_size / float(count),
+            'saving': 1 - slots_size / float(dict_size),
+            'make_push_per_second': count / elapsed,
+            }
+
+
+class PagedPushBullet(pb.PushBullet):
+    '''
+    API object serving pages from memory (to measure client side overhead only)
+    '''
+    def __init__(self, items):
+        pb.PushBullet.__init__(self, '')
+        self.items = items
+
+    def paged(self, _uri, prefetch=0, **params):
+        return iter(self.items)
+
+
+def bench_pushes_scan(count=100000):
+    api = PagedPushBullet([sample_push(n) for n in xrange(count)])
+    results = {'count': count}
+
+    for name, kwargs in (('objects', {}), ('raw', {'raw': True}), ('raw_fields', {'raw': True, 'fields': ['iden', 'dismissed']})):
+        started = time.time()
+        found = sum(1 for p in api.pushes(**kwargs) if p.get('dismissed') is False)
+        assert found == count
+        results['%s_per_second' % name] = count / (time.time() - started)
+
+    return results
+
+
+def request_times(metrics):
+    '''
+    Median and 99th percentile of requests total times for every endpoint
+    '''
+    return dict((key, {'p50': endpoint['total_time']['p50'], 'p99': endpoint['total_time']['p99'],
+                       'requests': endpoint['requests']})
+                for key, endpoint in metrics.snapshot().items())
+
+
+def bench_push_throughput(count=2000):
+    server = FakeServer().start()
+    metrics = pb.MetricsAggregator()
+    api = server.api(hooks=[metrics])
+
+    started = time.time()
+    for n in xrange(count):
+        api.push(pb.NotePush('Lorem ipsum dolor sit amet #%d' % n, title='Benchmark'))
+    elapsed = time.time() - started
+
+    server.stop()
+    return {
+            'count': count,
+            'pushes_per_second': count / elapsed,
+            'requests': request_times(metrics),
+            }
+
+
+def bench_paged(count=20000, latency=0.005, io_time=0.0002):
+    server = FakeServer(latency=latency).start().seed(pushes=count)
+    results = {'count': count, 'latency': latency, 'io_time': io_time}
+
+    for name, kwargs in (('objects', {}), ('raw', {'raw': True}), ('prefetch', {'prefetch': 2})):
+        api = server.api()
+        started = time.time()
+        found = sum(1 for _ in api.pushes(**kwargs))
+        assert found == count
+        results['%s_per_second' % name] = count / (time.time() - started)
+
+    # processing waiting for I/O (like a database write) for every push
+    for name, kwargs in (('io_objects', {}), ('io_prefetch', {'prefetch': 2})):
+        api = server.api()
+        started = time.time()
+        for _ in itertools.islice(api.pushes(**kwargs), count / 4):
+            time.sleep(io_time)
+        results['%s_per_second' % name] = count / 4 / (time.time() - started)
+
+    server.stop()
+    return results
+
+
+class Stream(object):
+    '''
+    Non-seekable file-like object (to force chunked upload)
+    '''
+    name = 'stream.bin'
+
+    def __init__(self, f):
+        self.read = f.read
+
+    def close(self):
+        pass
+
+
+def bench_upload(size=64 * 1024 * 1024, rounds=3):
+    server = FakeServer().start()
+    api = server.api()
+    data = 'x' * size
+    results = {'size': size}
+
+    for name, wrap in (('seekable', StringIO), ('chunked', lambda data: Stream(StringIO(data)))):
+        started = time.time()
+        for _ in xrange(rounds):
+            pb.FilePush(wrap(data), file_name='bench.bin', file_type='application/octet-stream').upload(api)
+        results['%s_mb_per_second' % name] = rounds * size / (time.time() - started) / 1024 / 1024
+
+    assert server.state.uploaded >= 2 * rounds * size
+
+    api = server.api(upload_cache=pb.UploadCache(os.path.join(tempfile.mkdtemp(), 'uploads.json')))
+    started = time.time()
+    for _ in xrange(rounds):
+        pb.FilePush(StringIO(data), file_name='bench.bin', file_type='application/octet-stream').upload(api)
+    results['cached_mb_per_second'] = rounds * size / (time.time() - started) / 1024 / 1024
+
+    server.stop()
+    return results
+
+
+def bench_concurrency(count=200, latency=0.02, levels=(1, 2, 4, 8, 16, 32)):
+    server = FakeServer(latency=latency).start()
+    results = {'count': count, 'latency': latency}
+
+    for concurrency in levels:
+        api = server.api(pool=pb.ConnectionPool(size=concurrency))
+        push = lambda n: api.push(pb.NotePush('Concurrent push #%d' % n))
+
+        started = time.time()
+        outcomes = list(pb.run_concurrently(push, xrange(count), concurrency))
+        elapsed = time.time() - started
+
+        assert all(outcome.ok for outcome in outcomes)
+        results['pushes_per_second_%d' % concurrency] = count / elapsed
+
+    server.stop()
+    return results
+
+
+END = {'type': 'push', 'push': {'type': 'mirror', 'body': 'END'}}
+
+
+def serve_stream(frames, rate=None, burst=1, seed=0):
+    '''
+    Run fake API and stream servers in a child process (so they don't take benchmark's CPU time)
+
+    :returns: (API URL, stream URL, server process)
+    '''
+    parent, child = multiprocessing.Pipe()
+
+    def run():
+        server = FakeServer().start().seed(pushes=seed)
+        stream = FakeStream(frames + [END], rate, burst, state=server.state).start()
+        child.send((server.api_url, stream.stream_url))
+        while True:
+            time.sleep(60)
+
+    process = multiprocessing.Process(target=run)
+    process.daemon = True
+    process.start()
+    api_url, stream_url = parent.recv()
+    return api_url, stream_url, process
+
+
+def consume_stream(frames, rate=None, burst=1, with_pushes=False, **kwargs):
+    '''
+    Read events from fake stream until END push, measuring events rate, CPU time and latencies
+    '''
+    api_url, stream_url, process = serve_stream(frames, rate, burst)
+    metrics = pb.MetricsAggregator()
+    api = pb.PushBullet('fake', hooks=[metrics])
+    api.API_URL, api.STREAM_URL = api_url, stream_url
+
+    latency = pb.Histogram()
+    events = pushes = 0
+    started, cpu = time.time(), sum(os.times()[:2])
+
+    for event in api.stream(**kwargs):
+        events += 1
+        if isinstance(event, pb.PushEvent):
+            if event.push.get('body') == 'END':
+                break
+            latency.add(time.time() - event.push.get('created'))
+
+        if with_pushes:
+            pushes += sum(1 for _ in event.pushes())
+
+    elapsed, cpu = time.time() - started, sum(os.times()[:2]) - cpu
+    process.terminate()
+
+    return {
+            'frames': len(frames),
+            'events': events,
+            'pushes': pushes,
+            'requests': sum(endpoint['requests'] for endpoint in metrics.snapshot().values()),
+            'events_per_second': events / elapsed,
+            'cpu_us_per_event': cpu / events * 1e6,
+            'push_latency': latency.snapshot(),
+            'yield_time': api.stream_stats.yield_time.snapshot(),
+            }
+
+
+def bench_stream(count=20000):
+    mirrors = FakeStream.random_frames(count, mix={'mirror': 1}, seed=1)
+    mixed = FakeStream.random_frames(count / 4, seed=1)
+    return {
+            'flood': consume_stream(mirrors),
+            'bursts': consume_stream(mirrors[:count / 4], rate=5000, burst=250),
+            'mixed': consume_stream(mixed, rate=2000, with_pushes=True),
+            'mixed_coalesce': consume_stream(mixed, rate=2000, with_pushes=True, coalesce=0.05),
+            }
+
+
+BENCHMARKS = {
+        'push_memory': bench_push_memory,
+        'pushes_scan': bench_pushes_scan,
+        'push_throughput': bench_push_throughput,
+        'paged': bench_paged,
+        'upload': bench_upload,
+        'concurrency': bench_concurrency,
+        'stream': bench_stream,
+        }
+
+
+def main():
+    names = sys.argv[1:] or sorted(BENCHMARKS)
+    results = dict((name, BENCHMARKS[name]()) for name in names)
+    print(json.dumps({
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+        }, indent=2, sort_keys=True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,442 @@
+#!/usr/bin/env python2
+'''
+Fake PushBullet API and websocket stream servers (for benchmarks and offline experiments)
+
+Usage: fakeserver.py [port]
+
+Implements `users/me`, `pushes` (list with cursor paging, create, update, delete),
+`devices`, `contacts`, `upload-request` and the file upload endpoint
+over keep-alive HTTP/1.1, with configurable latency and errors rate, e.g.::
+
+    server = FakeServer(latency=0.01, error_rate=0.05).start()
+    server.seed(pushes=1000)
+    api = server.api()
+    for push in api.pushes():
+        print(push)
+
+Events stream is replayed from scripted or random frames sequences, e.g.::
+
+    stream = FakeStream(FakeStream.random_frames(1000), rate=100, state=server.state).start()
+    api.STREAM_URL = stream.stream_url
+    for event in api.stream():
+        print(event)
+'''
+
+from __future__ import print_function
+
+import re
+import sys
+import json
+import time
+import base64
+import hashlib
+import random
+import socket
+import struct
+import itertools
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+import pushybullet as pb
+
+
+class FakeState(object):
+    '''
+    In-memory PushBullet account data
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idens = itertools.count(1)
+        self.me = {'iden': 'ujfake', 'email': 'fake@example.com', 'email_normalized': 'fake@example.com', 'name': 'Fake User'}
+        self.pushes = []  # ordered by modification time (oldest first)
+        self.devices = []
+        self.contacts = []
+        self.uploaded = 0  # bytes received by upload endpoint
+
+    def new_iden(self):
+        return 'ujfake%010d' % next(self.idens)
+
+    def add_push(self, data):
+        now = time.time()
+        push = dict(data, iden=self.new_iden(), active=True, dismissed=False, created=now, modified=now,
+                    direction='self', sender_iden=self.me['iden'], receiver_iden=self.me['iden'])
+        with self.lock:
+            self.pushes.append(push)
+        return push
+
+    def update_push(self, iden, data):
+        with self.lock:
+            for index, push in enumerate(self.pushes):
+                if push['iden'] == iden:
+                    del self.pushes[index]
+                    push.update(data, modified=time.time())
+                    self.pushes.append(push)
+                    return push
+        return None
+
+    def list_pushes(self, modified_after=0, cursor=None, limit=500):
+        # cursor is modification time of the last push on previous page,
+        # so pages don't shift when pushes are added while paging
+        with self.lock:
+            pushes = [p for p in reversed(self.pushes)
+                      if p['modified'] > modified_after and (cursor is None or p['modified'] < cursor)]
+        page = pushes[:limit]
+        return page, (repr(page[-1]['modified']) if len(pushes) > limit else None)
+
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1  # send every response with a single write
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(';')[0], 16)
+                chunk = self.rfile.read(size + 2)[:size]
+                if not size:
+                    break
+                chunks.append(chunk)
+            return ''.join(chunks)
+
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def handle_request(self, method):
+        server = self.server
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        body = self.read_body()
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.error_rate and random.random() < server.error_rate:
+            return self.send_json({'error': {'message': 'fake server error'}}, server.error_status)
+
+        parts = url.path.strip('/').split('/')
+        if parts[0] == 'upload':
+            with server.state.lock:
+                server.state.uploaded += len(body)
+            return self.send_json(None, 204)
+
+        if parts[0] != 'v2' or len(parts) < 2:
+            return self.send_json({'error': {'message': 'not found'}}, 404)
+
+        if body and 'json' in self.headers.get('Content-Type', ''):
+            data = json.loads(body)
+        else:
+            data = dict(urlparse.parse_qsl(body))
+
+        handler = getattr(self, 'api_%s_%s' % (method.lower(), parts[1].replace('-', '_')), None)
+        if handler is None:
+            return self.send_json({'error': {'message': 'not found'}}, 404)
+
+        result = handler(parts[2:], dict(query, **data))
+        if result is None:
+            return self.send_json({'error': {'message': 'not found'}}, 404)
+
+        self.send_json(result)
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj) if obj is not None else ''
+        self.send_response(status)
+        if body:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        server = self.server
+        if status == 200 and server.truncate_rate and random.random() < server.truncate_rate:
+            # drop connection in the middle of response body
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = 1
+            return
+
+        self.wfile.write(body)
+
+    # API endpoints: api_<method>_<collection>(path after collection, request params)
+
+    def api_get_users(self, path, params):
+        return self.server.state.me
+
+    def api_get_pushes(self, path, params):
+        limit = min(int(params.get('limit') or self.server.page_size), self.server.page_size)
+        cursor = params.get('cursor')
+        pushes, cursor = self.server.state.list_pushes(
+                float(params.get('modified_after') or 0), float(cursor) if cursor else None, limit)
+        return {'pushes': pushes, 'cursor': cursor}
+
+    def api_post_pushes(self, path, params):
+        if path:
+            return self.server.state.update_push(path[0], params)
+        return self.server.state.add_push(params)
+
+    def api_delete_pushes(self, path, params):
+        if not path:
+            return None
+        push = self.server.state.update_push(path[0], {'active': False})
+        return {} if push else None
+
+    def api_get_devices(self, path, params):
+        return {'devices': self.server.state.devices}
+
+    def api_post_devices(self, path, params):
+        device = dict(params, iden=self.server.state.new_iden(), active=True)
+        with self.server.state.lock:
+            self.server.state.devices.append(device)
+        return device
+
+    def api_get_contacts(self, path, params):
+        return {'contacts': self.server.state.contacts}
+
+    def api_get_upload_request(self, path, params):
+        iden = self.server.state.new_iden()
+        return {
+                'file_name': params.get('file_name', 'file'),
+                'file_type': params.get('file_type', 'application/octet-stream'),
+                'file_url': 'http://%s:%d/files/%s/%s' % (self.server.server_address[0], self.server.server_port,
+                                                           iden, params.get('file_name', 'file')),
+                'upload_url': 'http://%s:%d/upload/%s' % (self.server.server_address[0], self.server.server_port, iden),
+                'data': {'key': iden, 'acl': 'public-read'},
+                }
+
+    api_post_upload_request = api_get_upload_request
+
+
+class FakeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    Fake PushBullet API server, serving every connection in its own thread
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0, error_rate=0, error_status=503, page_size=500,
+                 truncate_rate=0):
+        '''
+        :param tuple address: (host, port) to listen on, random free port by default
+        :param float latency: delay before every response (in seconds)
+        :param float error_rate: share of requests to fail with `error_status`
+        :param int error_status: HTTP status of failed requests
+        :param int page_size: max number of items per page
+        :param float truncate_rate: share of successful responses to cut off in the middle of body
+        '''
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.page_size = page_size
+        self.truncate_rate = truncate_rate
+        self.state = FakeState()
+
+    @property
+    def api_url(self):
+        return 'http://%s:%d/v2/%%s' % (self.server_address[0], self.server_port)
+
+    def start(self):
+        '''
+        Serve requests in a background thread
+        '''
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def api(self, apikey='fake', **kwargs):
+        '''
+        Make API object talking to this server
+        '''
+        api = pb.PushBullet(apikey, **kwargs)
+        api.API_URL = self.api_url
+        return api
+
+    def seed(self, pushes=0, devices=0, contacts=0):
+        '''
+        Fill account with generated data
+        '''
+        state = self.state
+        for n in xrange(pushes):
+            state.add_push({'type': 'note', 'title': 'Note #%d' % n, 'body': 'Lorem ipsum dolor sit amet ' * 4})
+        for n in xrange(devices):
+            state.devices.append({'iden': state.new_iden(), 'nickname': 'Device #%d' % n, 'model': 'Fake',
+                                  'type': 'stream', 'active': True, 'pushable': True})
+        for n in xrange(contacts):
+            state.contacts.append({'iden': state.new_iden(), 'name': 'Contact #%d' % n, 'active': True,
+                                   'email': 'contact%d@example.com' % n, 'email_normalized': 'contact%d@example.com' % n})
+        return self
+
+
+class FakeStream(object):
+    '''
+    Fake PushBullet websocket stream server (minimal RFC 6455: server to client text frames only)
+
+    Every connection gets `frames` replayed at `rate` frames per second (as fast as
+    possible if None), sent in bursts of `burst` frames. Frames are dicts like `{"type": "nop"}`.
+    Pushes in "push" frames get `created` set to the time they are sent, so consumers
+    can measure delivery latency. If `state` of a `FakeServer` is given, a new note push
+    is added to it before every push tickle is sent.
+    '''
+    GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+    def __init__(self, frames=(), rate=None, burst=1, address=('127.0.0.1', 0), state=None, heartbeat=30):
+        '''
+        :param frames: frames to replay to every connection
+        :type frames: list of dict
+        :param float rate: frames per second, as fast as possible by default
+        :param int burst: number of frames to send at once
+        :param tuple address: (host, port) to listen on, random free port by default
+        :param FakeState state: fake server state to add pushes to on tickles
+        :param float heartbeat: interval of "nop" frames sent after all frames are replayed
+        '''
+        self.frames = list(frames)
+        self.rate = rate
+        self.burst = burst
+        self.state = state
+        self.heartbeat = heartbeat
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(address)
+        self.sock.listen(128)
+        self.server_address = self.sock.getsockname()
+
+    @property
+    def stream_url(self):
+        return 'ws://%s:%d/websocket/%%s' % self.server_address
+
+    @staticmethod
+    def random_frames(count, mix=None, seed=None):
+        '''
+        Generate random sequence of frames
+
+        :param int count: number of frames
+        :param dict mix: relative weights of "nop", "tickle", "mirror" and "dismissal" frames
+        :param seed: random generator seed (for reproducible sequences)
+        :rtype: list of dict
+        '''
+        mix = mix or {'nop': 1, 'tickle': 4, 'mirror': 4, 'dismissal': 1}
+        make = {
+                'nop': lambda n: {'type': 'nop'},
+                'tickle': lambda n: {'type': 'tickle', 'subtype': 'push'},
+                'mirror': lambda n: {'type': 'push', 'push': {
+                    'type': 'mirror', 'title': 'Notification #%d' % n, 'body': 'Lorem ipsum dolor sit amet',
+                    'application_name': 'Fake', 'package_name': 'com.example.fake',
+                    'notification_id': str(n), 'source_device_iden': 'ujfakedevice', 'dismissable': True}},
+                'dismissal': lambda n: {'type': 'push', 'push': {
+                    'type': 'dismissal', 'package_name': 'com.example.fake',
+                    'notification_id': str(n), 'source_device_iden': 'ujfakedevice'}},
+                }
+        rnd = random.Random(seed)
+        kinds = [kind for kind, weight in sorted(mix.items()) for _ in xrange(weight)]
+        return [make[rnd.choice(kinds)](n) for n in xrange(count)]
+
+    def start(self):
+        '''
+        Accept connections in a background thread
+        '''
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.sock.close()
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                break
+
+            thread = threading.Thread(target=self.handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    @staticmethod
+    def encode(text):
+        length = len(text)
+        if length < 126:
+            header = struct.pack('!BB', 0x81, length)
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x81, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x81, 127, length)
+        return header + text
+
+    def handle(self, conn):
+        try:
+            request = ''
+            while '\r\n\r\n' not in request:
+                data = conn.recv(4096)
+                if not data:
+                    return
+                request += data
+
+            key = re.search(r'(?im)^Sec-WebSocket-Key:\s*(\S+)', request).group(1)
+            accept = base64.b64encode(hashlib.sha1(key + self.GUID).digest())
+            conn.sendall('HTTP/1.1 101 Switching Protocols\r\n'
+                         'Upgrade: websocket\r\n'
+                         'Connection: Upgrade\r\n'
+                         'Sec-WebSocket-Accept: %s\r\n\r\n' % accept)
+
+            started = time.time()
+            for index in xrange(0, len(self.frames), self.burst):
+                if self.rate:
+                    delay = started + index / float(self.rate) - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                conn.sendall(''.join(self.encode(json.dumps(self.prepare(frame)))
+                                     for frame in self.frames[index:index + self.burst]))
+
+            while True:
+                time.sleep(self.heartbeat)
+                conn.sendall(self.encode(json.dumps({'type': 'nop'})))
+
+        except socket.error:
+            pass  # client has gone
+
+        finally:
+            conn.close()
+
+    def prepare(self, frame):
+        if frame['type'] == 'push':
+            return dict(frame, push=dict(frame['push'], created=time.time()))
+
+        if frame['type'] == 'tickle' and self.state is not None:
+            self.state.add_push({'type': 'note', 'title': 'Tickled', 'body': 'Lorem ipsum dolor sit amet'})
+
+        return frame
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    server = FakeServer(('127.0.0.1', port)).seed(pushes=100, devices=3, contacts=3)
+    stream = FakeStream(FakeStream.random_frames(1000), rate=1, address=('127.0.0.1', port + 1), state=server.state)
+    print('Serving fake PushBullet API at %s' % server.api_url.replace('%s', ''))
+    print('Serving fake PushBullet stream at %s' % stream.stream_url.replace('%s', ''))
+    stream.start()
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
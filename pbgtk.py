@@ -102,33 +102,37 @@ def main():
 
         return
 
-    def pb_watch():
-        for ev in pb.stream(use_server_time=True):
-            for push in ev.pushes(skip_empty=True):
-                if push.type in ('dismissal'):
-                    continue
+    dispatcher = pushybullet.EventDispatcher(workers=4)
+
+    @dispatcher.on_push()
+    def notify_push(push):
+        if push.type in ('dismissal'):
+            return
 
-                try:
-                    print(str(type(push)), push.json())
+        try:
+            print(str(type(push)), push.json())
 
-                    title = push.get('title') or get_play_app_name(push.get('package_name')) or "PushBullet"
-                    body = push.get('body') or push.get('url') or '\n'.join('— %s' % i for i in push.get('items')) or push.get('file_name')
+            title = push.get('title') or get_play_app_name(push.get('package_name')) or "PushBullet"
+            body = push.get('body') or push.get('url') or '\n'.join('— %s' % i for i in push.get('items')) or push.get('file_name')
 
-                    if 'icon' in push:
-                        loader = GdkPixbuf.PixbufLoader.new_with_type('jpeg')
-                        loader.write(push.icon)
-                        loader.close()
+            if 'icon' in push:
+                loader = GdkPixbuf.PixbufLoader.new_with_type('jpeg')
+                loader.write(push.icon)
+                loader.close()
 
-                        notify = Notify.Notification.new(title, body)
-                        notify.set_icon_from_pixbuf(loader.get_pixbuf())
+                notify = Notify.Notification.new(title, body)
+                notify.set_icon_from_pixbuf(loader.get_pixbuf())
 
-                    else:
-                        notify = Notify.Notification.new(title, body, icon_path)
+            else:
+                notify = Notify.Notification.new(title, body, icon_path)
 
-                    notify.show()
+            notify.show()
 
-                except Exception as e:
-                    print(e)
+        except Exception as e:
+            print(e)
+
+    def pb_watch():
+        dispatcher.run(pb.stream(use_server_time=True))
 
     pb_thread = Thread(target=pb_watch)
 
@@ -2,6 +2,16 @@
 
 from StringIO import StringIO
 import os
+import copy
+import collections
+import itertools
+import bisect
+import math
+import codecs
+import re
+import hashlib
+import tempfile
+import stat
 import datetime
 import time
 import base64
@@ -11,6 +21,10 @@ import urllib
 import urlparse
 import httplib
 import random
+import select
+import socket
+import threading
+import Queue
 
 try:
     import simplejson as json
@@ -76,38 +90,559 @@ def filelike_generator(func):
         return FilelikeGenerator(func(*args, **kwargs))
     return wrapper
 
+class ConnectionPool(object):
+    '''
+    Per-host pool of keep-alive HTTP connections
+
+    Idle connections are kept for `idle_timeout` seconds, at most `size` of them
+    per (scheme, host, port) triple. Connections closed by the server while idle
+    are detected and dropped before reuse.
+    '''
+
+    def __init__(self, size=4, idle_timeout=60, timeout=None):
+        '''
+        :param int size: max number of idle connections to keep per host
+        :param float idle_timeout: drop connections idle for longer than this (in seconds)
+        :param float timeout: socket timeout for new connections (in seconds)
+        '''
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.__lock = threading.Lock()
+        self.__idle = {}
+
+    def acquire(self, scheme, host, port):
+        '''
+        Get an idle connection to given host or open a new one
+
+        :returns: (connection, reused) pair
+        '''
+        now = time.time()
+        with self.__lock:
+            idle = self.__idle.get((scheme, host, port), [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used < self.idle_timeout and not self.is_stale(conn):
+                    return conn, True
+                conn.close()
+
+        return self.connect(scheme, host, port), False
+
+    def release(self, conn, scheme, host, port):
+        '''
+        Return connection to the pool (or close it if the pool is full)
+        '''
+        if conn.sock is not None:
+            with self.__lock:
+                idle = self.__idle.setdefault((scheme, host, port), [])
+                if len(idle) < self.size:
+                    idle.append((conn, time.time()))
+                    return
+
+        conn.close()
+
+    def connect(self, scheme, host, port):
+        connclass = {'http': httplib.HTTPConnection,
+                     'https': httplib.HTTPSConnection}[scheme]
+        if self.timeout is None:
+            return connclass(host, port)
+        return connclass(host, port, timeout=self.timeout)
+
+    def open(self, conn):
+        '''
+        Open new connection's socket, measuring TCP connect and TLS handshake times separately
+
+        :returns: (connect time, TLS handshake time or None for plain HTTP)
+        '''
+        started = time.time()
+        context = getattr(conn, '_context', None)
+        if not isinstance(conn, httplib.HTTPSConnection) or context is None:
+            conn.connect()
+            return time.time() - started, None
+
+        httplib.HTTPConnection.connect(conn)
+        connected = time.time()
+        conn.sock = context.wrap_socket(conn.sock, server_hostname=getattr(conn, '_tunnel_host', None) or conn.host)
+        return connected - started, time.time() - connected
+
+    def is_stale(self, conn):
+        '''
+        Check if idle connection was closed by the other side
+
+        An idle keep-alive socket must never be readable: if it is,
+        it's either EOF (server closed connection) or garbage.
+        '''
+        if conn.sock is None:
+            return True
+
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return True
+
+        return bool(readable)
+
+    def clear(self):
+        '''
+        Close all idle connections
+        '''
+        with self.__lock:
+            idle, self.__idle = self.__idle, {}
+
+        for conns in idle.itervalues():
+            for conn, _ in conns:
+                conn.close()
+
+def file_size(f):
+    '''
+    Get number of bytes left to read from a file-like object
+
+    :returns: size or None if it can't be determined (e.g. for pipes and sockets)
+    '''
+    try:
+        st = os.fstat(f.fileno())
+        if stat.S_ISREG(st.st_mode):
+            return st.st_size - f.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        pass
+
+    try:
+        pos = f.tell()
+        f.seek(0, os.SEEK_END)
+        size = f.tell() - pos
+        f.seek(pos)
+        return size
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+def file_tell(f):
+    '''
+    Get current position of a file-like object or None if it's not seekable
+    '''
+    try:
+        pos = f.tell()
+        f.seek(pos)
+        return pos
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+class PrefixedFile(object):
+    '''
+    File-like object reading already consumed `prefix` first and then the rest of `file`
+    '''
+    def __init__(self, prefix, file):
+        self.prefix = prefix
+        self.file = file
+        self.name = getattr(file, 'name', None)
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.file.read() if size is None or size < 0 else self.file.read(size)
+
+        if size is None or size < 0:
+            data, self.prefix = self.prefix + self.file.read(), ''
+        else:
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+        return data
+
+    def close(self):
+        self.file.close()
+
+class MimeDetector(object):
+    '''
+    Thread-safe file MIME type detector
+
+    Type is guessed by file name extension first (see `mimetypes` module), and only
+    if it's unknown, first `prefix_size` bytes of content are checked with libmagic
+    (if `magic` module is available). Magic database is loaded once and shared by
+    all threads, content detection results are cached by prefix digest.
+    '''
+    DEFAULT = 'application/octet-stream'
+
+    def __init__(self, prefix_size=1024, cache_size=1024, use_extension=True):
+        '''
+        :param int prefix_size: number of bytes of content to detect type by
+        :param int cache_size: max number of cached detection results
+        :param bool use_extension: guess type by file name extension before looking at content
+        '''
+        self.prefix_size = prefix_size
+        self.cache_size = cache_size
+        self.use_extension = use_extension
+        self.__lock = threading.Lock()
+        self.__cache = collections.OrderedDict()
+        self.__magic = None
+
+    def detect(self, file, name=None):
+        '''
+        Detect MIME type of a file-like object
+
+        Non-seekable streams (like `sys.stdin`) can't be rewound after their prefix
+        is read, so use the returned file object instead of the original one.
+
+        :param file: file-like object
+        :param str name: file name (defaults to `file.name`)
+        :returns: (MIME type, file object to read content from)
+        '''
+        mime_type = self.from_name(name or getattr(file, 'name', None))
+        if mime_type:
+            return mime_type, file
+
+        prefix, file = self.peek(file, self.prefix_size)
+        return self.from_buffer(prefix), file
+
+    def from_name(self, name):
+        '''
+        Guess MIME type by file name extension (None if unknown)
+        '''
+        if not self.use_extension or not isinstance(name, basestring):
+            return None
+
+        import mimetypes
+        return mimetypes.guess_type(name, strict=False)[0]
+
+    def from_buffer(self, data):
+        '''
+        Detect MIME type of content by its prefix
+        '''
+        key = hashlib.sha1(data[:self.prefix_size]).digest()
+        with self.__lock:
+            try:
+                mime_type = self.__cache.pop(key)
+            except KeyError:
+                mime_type = self.__detect(data[:self.prefix_size])
+
+            self.__cache[key] = mime_type
+            while len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
+
+        return mime_type
+
+    def __detect(self, data):
+        # libmagic handles are not thread-safe, must be called under lock
+        if self.__magic is None:
+            self.__magic = self.load_magic()
+
+        if not self.__magic or not data:
+            return self.DEFAULT
+
+        try:
+            return self.__magic(data) or self.DEFAULT
+        except Exception:
+            return self.DEFAULT
+
+    @staticmethod
+    def load_magic():
+        '''
+        Load magic database, return function detecting MIME type of a buffer (False if `magic` is unavailable)
+        '''
+        try:
+            import magic
+        except ImportError:
+            return False
+
+        try:
+            if hasattr(magic, 'open'):  # libmagic bindings shipped with file
+                handle = magic.open(magic.MIME_TYPE)
+                handle.load()
+                return handle.buffer
+            return magic.Magic(mime=True).from_buffer  # python-magic
+        except Exception:
+            return False
+
+    @staticmethod
+    def peek(file, size):
+        '''
+        Read up to `size` bytes from file without consuming them
+
+        :returns: (prefix, file object to read content from)
+        '''
+        pos = file_tell(file)
+        prefix = file.read(size)
+        if pos is not None:
+            file.seek(pos)
+            return prefix, file
+        return prefix, PrefixedFile(prefix, file)
+
+class Quota(collections.namedtuple('Quota', 'limit remaining reset')):
+    '''
+    Rate limit quota reported by server: `remaining` of `limit` points left until `reset` timestamp
+    '''
+    __slots__ = ()
+
+class RequestMetrics(collections.namedtuple('RequestMetrics', 'method host endpoint status bytes_sent bytes_received '
+                                                             'connect_time tls_time first_byte_time total_time retries error')):
+    '''
+    Measurements of a single HTTP request made by session (passed to `Session.hooks`)
+
+    Times are in seconds: `connect_time` and `tls_time` are spent opening new connections
+    (None if a keep-alive connection was reused), `first_byte_time` is time from sending
+    request to getting response headers, `total_time` includes retries and reading response body.
+    Sizes are of request and response bodies. `error` is exception class name if request failed.
+    '''
+    __slots__ = ()
+
+class RateLimiter(object):
+    '''
+    Token bucket to pace requests according to server's rate limits
+
+    The bucket is shared by all threads using it. Requests are not paced while more than
+    `threshold` part of quota remains. Below it, refill rate is recalculated from
+    `X-Ratelimit-*` headers of every response, so that remaining quota is spread evenly
+    until the quota reset time, with up to `burst` requests allowed to go at once.
+    Only hosts which reported rate limits are paced.
+    '''
+
+    def __init__(self, burst=10, threshold=0.2):
+        '''
+        :param int burst: max number of requests to send without pacing
+        :param float threshold: part of quota left to start pacing at
+        '''
+        self.burst = burst
+        self.threshold = threshold
+        self.hosts = set()
+        self.quota = Quota(None, None, None)
+        self.__lock = threading.Lock()
+        self.__rate = None
+        self.__tokens = float(burst)
+        self.__updated = time.time()
+
+    def __refill(self, now):
+        reset = self.quota.reset
+        if reset is not None and now >= reset:
+            self.__rate, self.__tokens = None, float(self.burst)  # quota is restored
+            self.quota = Quota(self.quota.limit, self.quota.limit, None)
+
+        elif self.__rate is not None:
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.__rate)
+
+        self.__updated = now
+
+    def acquire(self, host):
+        '''
+        Take a token for a request to given host, wait for it if necessary
+        '''
+        if host not in self.hosts:
+            return
+
+        while True:
+            with self.__lock:
+                now = time.time()
+                self.__refill(now)
+                if self.__rate is None:
+                    return
+
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+
+                wait = (1 - self.__tokens) / self.__rate if self.__rate > 0 else 1
+                if self.quota.reset is not None:
+                    wait = min(wait, self.quota.reset - now)
+
+            time.sleep(max(0.01, wait))
+
+    def update(self, host, response):
+        '''
+        Update the bucket from response rate limit headers
+        '''
+        try:
+            limit = int(response.getheader('X-Ratelimit-Limit'))
+            remaining = int(response.getheader('X-Ratelimit-Remaining'))
+            reset = float(response.getheader('X-Ratelimit-Reset'))
+        except (TypeError, ValueError):
+            return
+
+        with self.__lock:
+            now = time.time()
+            self.hosts.add(host)
+            self.quota = Quota(limit, remaining, reset)
+            if remaining >= limit * self.threshold:
+                self.__rate, self.__tokens = None, float(self.burst)
+            else:
+                self.__rate = max(0, remaining) / max(1.0, reset - now)
+                self.__tokens = min(self.__tokens, max(0, remaining))
+            self.__updated = now
+
+class RetryPolicy(object):
+    '''
+    Rules to retry failed requests with exponential backoff
+
+    A request is retried if it fails with one of `exceptions` or gets response
+    with one of `statuses`, and its method is in `methods` (non-idempotent requests,
+    like POST, are not retried by default, as the server could have processed them already)
+    or the request is marked as idempotent (like file uploads).
+    Delay before n-th retry is a random value between 0 and `backoff * 2 ** n` ("full jitter"),
+    but no more than `max_backoff` seconds. Retries stop after `total` retries or when
+    `max_elapsed` seconds have passed since the first attempt.
+    '''
+
+    def __init__(self, total=3, backoff=0.5, max_backoff=30, max_elapsed=120,
+            statuses=(429, 500, 502, 503, 504),
+            exceptions=(socket.error, httplib.HTTPException),
+            methods=('GET', 'HEAD', 'DELETE', 'PUT', 'OPTIONS')):
+        self.total = total
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_elapsed = max_elapsed
+        self.statuses = frozenset(statuses)
+        self.exceptions = tuple(exceptions)
+        self.methods = frozenset(methods)
+
+    def allows(self, method, attempt, started, idempotent=False):
+        '''
+        Check if a request can be retried once more
+        '''
+        return ((idempotent or method in self.methods) and attempt < self.total and
+                time.time() - started < self.max_elapsed)
+
+    def delay(self, attempt, response=None):
+        '''
+        Get delay before next retry (respecting `Retry-After` response header if present)
+        '''
+        try:
+            return min(self.max_backoff, float(response.getheader('Retry-After')))
+        except (AttributeError, TypeError, ValueError):
+            return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+class JSONItemsDecoder(object):
+    '''
+    Incremental decoder for JSON objects like `{"items": [{...}, {...}], "cursor": "..."}`
+
+    Items of given array member are decoded and yielded one by one as response
+    body arrives, so the whole document is never held in memory. Other top-level
+    members are collected into `members` dict as they are met.
+    '''
+
+    WHITESPACE = re.compile(r'[ \t\n\r]*')
+    DELIMITERS = frozenset(u' \t\n\r,:]}')
+
+    def __init__(self, read, chunk_size=65536):
+        '''
+        :param callable read: function to read a chunk of bytes of given size (like `file.read`)
+        '''
+        self.members = {}
+        self.__read = read
+        self.__chunk_size = chunk_size
+        self.__decoder = json.JSONDecoder()
+        self.__utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.__buf = u''
+        self.__pos = 0
+        self.__eof = False
+
+    def __fill(self):
+        if self.__eof:
+            raise ValueError('unexpected end of JSON document')
+
+        chunk = self.__read(self.__chunk_size)
+        self.__eof = not chunk
+        self.__buf = self.__buf[self.__pos:] + self.__utf8.decode(chunk or '', self.__eof)
+        self.__pos = 0
+
+    def __peek(self):
+        while True:
+            self.__pos = self.WHITESPACE.match(self.__buf, self.__pos).end()
+            if self.__pos < len(self.__buf):
+                return self.__buf[self.__pos]
+            self.__fill()
+
+    def __expect(self, chars):
+        char = self.__peek()
+        if char not in chars:
+            raise ValueError('unexpected %r in JSON document, expected one of %r' % (char, chars))
+        self.__pos += 1
+        return char
+
+    def __value(self):
+        self.__peek()
+        while True:
+            try:
+                value, end = self.__decoder.raw_decode(self.__buf, self.__pos)
+                # a number is complete only if followed by a delimiter, as it can be cut
+                # at the end of buffer (like `1.` of `1.5`, decoded as `1`)
+                if self.__eof or type(value) not in (int, long, float) or (
+                        end < len(self.__buf) and self.__buf[end] in self.DELIMITERS):
+                    self.__pos = end
+                    return value
+            except ValueError:
+                if self.__eof:
+                    raise
+            self.__fill()
+
+    def iterate(self, key):
+        '''
+        Generator yields items of `key` array member
+        '''
+        self.__expect('{')
+        if self.__peek() == '}':
+            return
+
+        while True:
+            name = self.__value()
+            self.__expect(':')
+
+            if name == key and self.__peek() == '[':
+                self.__pos += 1
+                if self.__peek() == ']':
+                    self.__pos += 1
+                else:
+                    while True:
+                        yield self.__value()
+                        if self.__expect(',]') == ']':
+                            break
+            else:
+                self.members[name] = self.__value()
+
+            if self.__expect(',}') == '}':
+                break
+
 class Session(object):
     auth = ()
     headers = {}
+    chunk_size = 65536
+
+    def __init__(self, pool=None, rate_limiter=None, retry=None, hooks=None):
+        self.pool = pool or ConnectionPool()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retry = retry or RetryPolicy()
+        self.hooks = list(hooks or ())
 
     def get(self, url, params=None, auth=None, headers=None):
         return self._request('GET', url, params=params, auth=auth, headers=headers)
 
-    def post(self, url, params=None, data=None, files=None, auth=None, headers=None):
-        return self._request('POST', url, params=params, data=data, files=files, auth=auth, headers=headers)
+    def post(self, url, params=None, data=None, files=None, auth=None, headers=None, idempotent=False):
+        return self._request('POST', url, params=params, data=data, files=files, auth=auth, headers=headers,
+                             idempotent=idempotent)
 
     def delete(self, url, params=None, auth=None, headers=None):
         return self._request('DELETE', url, params=params, auth=auth, headers=headers)
 
     def _encode_form_data(self, pairs):
+        '''
+        Encode multipart form data lazily
+
+        Files are read in `chunk_size` blocks while the body is sent, so they are never
+        loaded into memory as a whole.
+
+        :returns: (content type, body chunks generator, body length or None if unknown)
+        '''
         boundary = ''.join(chr(random.choice(xrange(ord('a'), ord('z')))) for _ in xrange(0, 30))
 
-        body = []
+        parts = []
         for name, value in pairs:
             if hasattr(value, 'read'):
-                _body = value.read()
-                body.append(
+                size = file_size(value)
+                parts.append((
                     'Content-Type: application/octet-stream\r\n'
                     'Content-Disposition: form-data; name="%s"; filename="%s"\r\n'
-                    'Content-Length: %s\r\n'
-                    '\r\n'
-                    '%s' % (
+                    '%s'
+                    '\r\n' % (
                         urllib.quote(name),
                         urllib.quote(getattr(value, 'name', None) or "file.txt"),
-                        len(_body),
-                        _body))
+                        'Content-Length: %s\r\n' % size if size is not None else ''),
+                    value, size))
             else:
-                body.append(
+                value = utf8(value).encode('utf-8')
+                parts.append((
                         'Content-Type: text/plain\r\n'
                         'Content-Disposition: form-data; name="%s"\r\n'
                         'Content-Length: %s\r\n'
@@ -115,16 +650,159 @@ class Session(object):
                         '%s' % (
                             urllib.quote(name),
                             len(value),
-                            value))
+                            value),
+                        None, 0))
+
+        delimiter, closing = '\r\n--%s\r\n' % boundary, '\r\n--%s--\r\n' % boundary
+
+        if all(size is not None for _, _, size in parts):
+            length = (sum(len(head) + size for head, _, size in parts) +
+                      len(delimiter) * len(parts) - 2 + len(closing))
+        else:
+            length = None
+
+        def body():
+            for index, (head, value, size) in enumerate(parts):
+                yield delimiter[2:] if index == 0 else delimiter
+                yield head
+
+                if value is None:
+                    continue
+
+                while size is None or size > 0:
+                    chunk = value.read(self.chunk_size if size is None else min(size, self.chunk_size))
+                    if not chunk:
+                        break
 
-        return 'multipart/form-data; boundary="%s"' % boundary, ('--%s\r\n' % boundary) + ('\r\n--%s\r\n' % boundary).join(body) + ('\r\n--%s--\r\n' % boundary)
+                    if size is not None:
+                        size -= len(chunk)
+                    yield chunk
+
+            yield closing
+
+        return 'multipart/form-data; boundary="%s"' % boundary, body(), length
+
+    def _send(self, conn, method, path, body, headers):
+        '''
+        Send request with either a string or a chunks generator body
+
+        Generator bodies without known Content-Length are sent with chunked transfer encoding.
+
+        :returns: number of body bytes sent
+        '''
+        if body is None or isinstance(body, basestring):
+            conn.request(method, path, body, headers)
+            return len(body or '')
+
+        conn.putrequest(method, path, skip_host='Host' in headers)
+        for name, value in headers.iteritems():
+            conn.putheader(name, value)
+
+        chunked = 'Content-Length' not in headers
+        if chunked:
+            conn.putheader('Transfer-Encoding', 'chunked')
+        conn.endheaders()
+
+        sent = 0
+        for chunk in body:
+            if chunk:
+                conn.send('%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+                sent += len(chunk)
+
+        if chunked:
+            conn.send('0\r\n\r\n')
+
+        return sent
+
+    @staticmethod
+    def endpoint(path):
+        '''
+        Request path with object idens replaced with "*" (to group requests metrics)
+
+        Only API version and collection name are kept (e.g. `/v2/pushes/*`),
+        other paths keep the first segment only (e.g. `/upload/*` for file upload URLs).
+        '''
+        parts = path.split('/')
+        keep = 3 if len(parts) > 2 and re.match(r'^v\d+$', parts[1]) else 2
+        return '/'.join(parts[:keep] + ['*'] * (len(parts) - keep))
+
+    def _report(self, metrics, started):
+        if not self.hooks:
+            return
+
+        metrics = RequestMetrics(total_time=time.time() - started, **metrics)
+        for hook in self.hooks:
+            try:
+                hook(metrics)
+            except Exception:
+                pass  # broken metrics hooks must never break requests
 
     class Response(object):
-        def __init__(self, resp):
+        def __init__(self, resp, release=None):
             self.__resp = resp
+            self.__release = release
+            self.received = 0
+
+        def __read(self, amt=None):
+            data = self.__resp.read() if amt is None else self.__resp.read(amt)
+            self.received += len(data)
+            return data
 
         def json(self):
-            return json.load(self.__resp)
+            try:
+                return json.loads(self.__read())
+            finally:
+                self.release()
+
+        def iter_json(self, key, members):
+            '''
+            Decode JSON object response incrementally, yielding items of `key` array
+
+            Other top-level members of the object are put into `members` dict.
+            '''
+            decoder = JSONItemsDecoder(self.__read)
+            completed = False
+            try:
+                for item in decoder.iterate(key):
+                    members.update(decoder.members)
+                    yield item
+                members.update(decoder.members)
+                completed = True
+            except ValueError:
+                if self.__resp.length:  # connection was dropped before the whole body was received
+                    raise httplib.IncompleteRead('', self.__resp.length)
+                raise
+            finally:
+                if completed:
+                    self.release()
+                else:
+                    self.close()
+
+        def release(self):
+            '''
+            Consume the rest of response body and give the connection back to the session
+            '''
+            if self.__release is None:
+                return
+
+            release, self.__release = self.__release, None
+            try:
+                self.__read()
+                reusable = not self.__resp.will_close
+            except (httplib.HTTPException, socket.error):
+                reusable = False
+
+            release(reusable, self.received)
+
+        def close(self):
+            '''
+            Drop the response with its connection without reading the rest of body
+            '''
+            if self.__release is None:
+                return
+
+            release, self.__release = self.__release, None
+            release(False, self.received)
 
         def raise_for_status(self):
             status = self.__resp.status
@@ -133,19 +811,21 @@ class Session(object):
             if kind in (1, 2, 3):
                 return
 
+            self.release()
             raise RuntimeError('%s %s' % (status, self.__resp.reason))
 
-    def _request(self, method, url, params=None, data=None, files=None, auth=None, headers=None):
+    def _request(self, method, url, params=None, data=None, files=None, auth=None, headers=None, idempotent=False):
         _url = urlparse.urlparse(url)
 
-        conn = {'http': httplib.HTTPConnection,
-                'https': httplib.HTTPSConnection}[_url.scheme](_url.hostname, _url.port)
-
         if params:
             _params = params.copy()
             for k in _params.keys():
                 if _params[k] is None:
                     del _params[k]
+                elif isinstance(_params[k], float):
+                    # str() keeps only 12 significant digits in Python 2, which rounds timestamps
+                    # (like `modified_after` cursors) to 10ms, so pushes modified right after them are lost
+                    _params[k] = repr(_params[k])
 
             _query = urllib.urlencode(_params)
 
@@ -156,18 +836,15 @@ class Session(object):
         _headers['Host'] = _url.hostname
 
         if files:
-            content_type, _data = self._encode_form_data(p for n in (data, files) for p in n.iteritems())
+            offsets = [(f, file_tell(f)) for f in files.itervalues()]
+            replayable = all(pos is not None for _, pos in offsets)
 
         elif data:
-            content_type, _data = ('application/x-www-form-urlencoded',
-                    urllib.urlencode(data) if isinstance(data, dict) else str(data))
+            _data, replayable = (urllib.urlencode(data) if isinstance(data, dict) else str(data)), True
+            _headers['Content-Type'] = 'application/x-www-form-urlencoded'
 
         else:
-            content_type, _data = None, None
-
-        if _data:
-            _headers['Content-Type'] = content_type
-            #_headers['Content-Length'] = str(len(_data))
+            _data, replayable = None, True
 
         if headers:
             _headers.update(headers)
@@ -179,10 +856,94 @@ class Session(object):
         if _auth:
             _headers['Authorization'] = 'Basic %s' % base64.encodestring(':'.join(_auth)).strip()
 
-        conn.request(method, '?'.join((_url.path, _query)), _data, _headers)
+        host = (_url.scheme, _url.hostname, _url.port)
+        started, attempt, sent = time.time(), 0, False
+        metrics = dict(method=method, host=_url.hostname, endpoint=self.endpoint(_url.path), status=None,
+                       bytes_sent=0, bytes_received=0, connect_time=None, tls_time=None,
+                       first_byte_time=None, retries=0, error=None)
+        try:
+            while True:
+                if files:
+                    if sent:
+                        for f, pos in offsets:
+                            f.seek(pos)
+
+                    content_type, _data, length = self._encode_form_data(p for n in (data or {}, files) for p in n.iteritems())
+                    _headers['Content-Type'] = content_type
+                    _headers.pop('Content-Length', None)
+                    if length is not None:
+                        _headers['Content-Length'] = str(length)
+
+                self.rate_limiter.acquire(_url.hostname)
+                conn, reused = self.pool.acquire(*host)
+                written = False
+                try:
+                    sent = True
+                    if not reused:
+                        connect_time, tls_time = self.pool.open(conn)
+                        metrics['connect_time'] = (metrics['connect_time'] or 0) + connect_time
+                        if tls_time is not None:
+                            metrics['tls_time'] = (metrics['tls_time'] or 0) + tls_time
+
+                    sending = time.time()
+                    metrics['bytes_sent'] = self._send(conn, method, '?'.join((_url.path, _query)), _data, _headers)
+                    written = True
+                    response = conn.getresponse()
+                    metrics['first_byte_time'] = time.time() - sending
+
+                except self.retry.exceptions:
+                    conn.close()
+                    if not replayable:
+                        raise
+
+                    # keep-alive connection was dropped by server, reopen it, but once the request
+                    # is written the server could have processed it, so replay only idempotent ones
+                    if reused and (not written or idempotent or method in self.retry.methods):
+                        metrics['retries'] += 1
+                        continue
+
+                    if not self.retry.allows(method, attempt, started, idempotent):
+                        raise
+
+                    time.sleep(self.retry.delay(attempt))
+                    attempt += 1
+                    metrics['retries'] += 1
+                    continue
+
+                self.rate_limiter.update(_url.hostname, response)
+
+                if (response.status in self.retry.statuses and replayable and
+                        self.retry.allows(method, attempt, started, idempotent)):
+                    response.read()
+                    if response.will_close:
+                        conn.close()
+                    else:
+                        self.pool.release(conn, *host)
+
+                    time.sleep(self.retry.delay(attempt, response))
+                    attempt += 1
+                    metrics['retries'] += 1
+                    continue
+
+                break
+
+        except Exception as e:
+            metrics['error'] = e.__class__.__name__
+            self._report(metrics, started)
+            raise
 
-        response = conn.getresponse()
-        return self.Response(response)
+        metrics['status'] = response.status
+
+        def release(reusable, received):
+            if reusable:
+                self.pool.release(conn, *host)
+            else:
+                conn.close()
+
+            metrics['bytes_received'] = received
+            self._report(metrics, started)
+
+        return self.Response(response, release)
 
 def get_apikey_from_config():
     try:
@@ -197,30 +958,481 @@ def get_apikey_from_config():
     except:
         return None
 
-def utf8(s):
-    return s if isinstance(s, unicode) else unicode(s, 'utf-8') if isinstance(s, str) else unicode(s)
+def utf8(s):
+    return s if isinstance(s, unicode) else unicode(s, 'utf-8') if isinstance(s, str) else unicode(s)
+
+def parse_since(since):
+    if not since:
+        return 0
+
+    if isinstance(since, (long, int, float)):
+        return since + time.time() if since < 0 else since
+
+    if isinstance(since, datetime.date):
+        return since.strftime('%s')
+
+    if isinstance(since, datetime.timedelta):
+        return (datetime.datetime.now() - since).strftime('%s')
+
+    try:
+        since = int(since)
+        return since + time.time() if since < 0 else since
+
+    except ValueError:
+        from dateutil.parser import parse
+        return parse(since).strftime('%s')
+
+
+# Concurrency {{{
+class Future(object):
+    '''
+    Result of a call running in background
+    '''
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__done = threading.Event()
+        self.__result = None
+        self.__error = None
+        self.__callbacks = []
+
+    def set_result(self, result):
+        self.__result = result
+        self.__finish()
+
+    def set_exception(self, error):
+        self.__error = error
+        self.__finish()
+
+    def __finish(self):
+        with self.__lock:
+            self.__done.set()
+            callbacks, self.__callbacks = self.__callbacks, []
+
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        '''
+        Call `callback(future)` when the result is ready (immediately if it's ready already)
+        '''
+        with self.__lock:
+            if not self.__done.is_set():
+                self.__callbacks.append(callback)
+                return
+
+        callback(self)
+
+    def done(self):
+        return self.__done.is_set()
+
+    def exception(self, timeout=None):
+        '''
+        Wait for the call to finish and return exception raised by it (or None)
+        '''
+        if not self.__done.wait(timeout):
+            raise PushBulletError('result is not ready yet')
+        return self.__error
+
+    def result(self, timeout=None):
+        '''
+        Wait for the call to finish and return its result (or raise its exception)
+        '''
+        error = self.exception(timeout)
+        if error is not None:
+            raise error
+        return self.__result
+
+class WorkerPool(object):
+    '''
+    Bounded pool of worker threads
+
+    Threads are started lazily on first submitted calls.
+    '''
+    def __init__(self, size=8, queue_size=0):
+        '''
+        :param int size: number of worker threads
+        :param int queue_size: max number of pending calls (`submit()` blocks when full), 0 means unbounded
+        '''
+        self.size = size
+        self.__queue = Queue.Queue(queue_size)
+        self.__lock = threading.Lock()
+        self.__threads = []
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Schedule `func(*args, **kwargs)` call on the pool
+
+        :rtype: Future
+        '''
+        with self.__lock:
+            if len(self.__threads) < self.size:
+                thread = threading.Thread(target=self.__worker, args=(self.__queue,))
+                thread.daemon = True
+                thread.start()
+                self.__threads.append(thread)
+
+        future = Future()
+        self.__queue.put((future, func, args, kwargs))
+        return future
+
+    def map(self, func, items):
+        '''
+        Schedule `func(item)` for each item
+
+        :rtype: list of Future
+        '''
+        return [self.submit(func, item) for item in items]
+
+    def shutdown(self, wait=True):
+        '''
+        Stop all worker threads after pending calls are done
+        '''
+        with self.__lock:
+            threads, self.__threads = self.__threads, []
+
+        for _ in threads:
+            self.__queue.put(None)
+
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    @staticmethod
+    def __worker(queue):
+        while True:
+            task = queue.get()
+            if task is None:
+                break
+
+            future, func, args, kwargs = task
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+class BackgroundIterator(object):
+    '''
+    Iterator consuming another iterator in a background thread
+
+    Up to `size` items are read ahead into a buffer, so slow producers (like network requests)
+    and slow consumers run at the same time. Exceptions raised by the producer
+    are re-raised to the consumer.
+    '''
+    _END = object()
+
+    def __init__(self, it, size=1):
+        self.__queue = Queue.Queue(size)
+        self.__stop = threading.Event()
+        self.__done = False
+
+        thread = threading.Thread(target=self.__run, args=(iter(it), self.__queue, self.__stop))
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def __run(cls, it, queue, stop):
+        def put(item):
+            # blocking put without timeout, as timed waits poll with up to 50ms sleeps in Python 2;
+            # close() unblocks it by draining the queue
+            if stop.is_set():
+                return False
+            queue.put(item)
+            return not stop.is_set()
+
+        try:
+            for item in it:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((cls._END, e))
+        else:
+            put((cls._END, None))
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.__done:
+            raise StopIteration
+
+        item, error = self.__queue.get()
+        if item is self._END:
+            self.close()
+            if error is not None:
+                raise error
+            raise StopIteration
+
+        return item
+
+    def close(self):
+        '''
+        Stop background iteration
+        '''
+        self.__done = True
+        self.__stop.set()
+        try:
+            while True:
+                self.__queue.get_nowait()
+        except Queue.Empty:
+            pass
+
+    __del__ = close
+
+# }}}
+
+# Metrics {{{
+
+class Histogram(object):
+    '''
+    Thread-safe histogram of positive values (e.g. durations in seconds)
+
+    Values are counted in logarithmic buckets, so memory use doesn't depend
+    on number of values, and percentiles are estimated with relative error
+    of about `precision`.
+    '''
+    def __init__(self, precision=0.05, minimum=1e-6):
+        '''
+        :param float precision: max relative error of estimated percentiles
+        :param float minimum: values below this are counted as `minimum`
+        '''
+        self.precision = precision
+        self.minimum = minimum
+        self.__log_base = math.log(1 + 2 * precision)
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget all recorded values
+        '''
+        with self.__lock:
+            self.__buckets = {}
+            self.count = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
+
+    def add(self, value):
+        '''
+        Record a value
+        '''
+        bucket = int(math.floor(math.log(max(value, self.minimum) / self.minimum) / self.__log_base))
+        with self.__lock:
+            self.__buckets[bucket] = self.__buckets.get(bucket, 0) + 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent):
+        '''
+        Estimate value below which given percent of recorded values fall (None if there are no values)
+
+        :param float percent: percentile to get, from 0 to 100
+        '''
+        with self.__lock:
+            if not self.count:
+                return None
+
+            rank = max(1, int(math.ceil(self.count * percent / 100.0)))
+            seen = 0
+            for bucket in sorted(self.__buckets):
+                seen += self.__buckets[bucket]
+                if seen >= rank:
+                    break
+
+            # middle of the bucket, clamped to actually seen values
+            value = self.minimum * math.exp((bucket + 0.5) * self.__log_base)
+            return min(max(value, self.min), self.max)
+
+    def snapshot(self, percentiles=(50, 90, 99)):
+        '''
+        Get histogram summary as a dict with `count`, `mean`, `min`, `max` and `pNN` percentiles
+        '''
+        summary = dict(('p%g' % p, self.percentile(p)) for p in percentiles)
+        with self.__lock:
+            summary.update(count=self.count, min=self.min, max=self.max,
+                           mean=self.total / self.count if self.count else None)
+        return summary
+
+    def __repr__(self):
+        return '<Histogram count=%d mean=%s p99=%s>' % (self.count, self.mean, self.percentile(99))
+
+class StreamStats(object):
+    '''
+    Events stream latency histograms (all values are in seconds)
+
+    * `recv_time`: waiting for and reading a websocket frame,
+    * `lag`: time between push modification on server (`modified`) and receiving its tickle,
+    * `fetch_time`: fetching pushes of a tickle event,
+    * `yield_time`: time between receiving a frame and yielding its event to consumer.
+
+    Every `PushBullet` object records its stream timings into `api.stream_stats`
+    (assign the same object to several API objects to collect their timings together).
+    '''
+    NAMES = ('recv_time', 'lag', 'fetch_time', 'yield_time')
+
+    def __init__(self, precision=0.05):
+        for name in self.NAMES:
+            setattr(self, name, Histogram(precision))
+
+    def pushes(self, pushes, received):
+        '''
+        Record pushes fetch time and lag while iterating over pushes
+
+        :param pushes: pushes to iterate over
+        :param float received: local time the tickle for these pushes was received
+        :rtype: generator
+        '''
+        elapsed = 0.0
+        pushes = iter(pushes)
+        while True:
+            started = time.time()
+            try:
+                push = next(pushes)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.time() - started
+
+            self.push_lag(push, received)
+            yield push
+
+        self.fetch_time.add(elapsed)
+
+    def push_lag(self, push, received):
+        modified = push.get('modified')
+        if modified is not None:
+            self.lag.add(received - modified)
+
+    def snapshot(self):
+        '''
+        Get summaries of all histograms (see `Histogram.snapshot()`)
+
+        :rtype: dict
+        '''
+        return dict((name, getattr(self, name).snapshot()) for name in self.NAMES)
+
+    def dump(self, f):
+        '''
+        Write summaries of all histograms to file as JSON
+        '''
+        json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+
+    def reset(self):
+        for name in self.NAMES:
+            getattr(self, name).reset()
+
+class MetricsAggregator(object):
+    '''
+    In-memory requests metrics aggregated by endpoint (a `Session` hook)
+
+    Counts requests, statuses, errors, retries and transferred bytes, and collects
+    latency histograms (see `Histogram`) for every "METHOD host/endpoint" key, e.g.::
+
+        metrics = MetricsAggregator()
+        api = PushBullet(apikey, hooks=[metrics])
+        ...
+        print(metrics.snapshot()['GET api.pushbullet.com/v2/pushes']['total_time']['p99'])
+    '''
+    COUNTERS = ('requests', 'errors', 'retries', 'bytes_sent', 'bytes_received')
+    TIMES = ('connect_time', 'tls_time', 'first_byte_time', 'total_time')
+
+    def __init__(self, precision=0.05):
+        self.precision = precision
+        self.__lock = threading.Lock()
+        self.__endpoints = {}
+
+    def __call__(self, metrics):
+        key = '%s %s%s' % (metrics.method, metrics.host, metrics.endpoint)
+        with self.__lock:
+            endpoint = self.__endpoints.get(key)
+            if endpoint is None:
+                endpoint = self.__endpoints[key] = dict(
+                        ((name, 0) for name in self.COUNTERS),
+                        statuses={}, **dict((name, Histogram(self.precision)) for name in self.TIMES))
+
+            endpoint['requests'] += 1
+            endpoint['errors'] += metrics.error is not None or (metrics.status or 0) >= 400
+            endpoint['retries'] += metrics.retries
+            endpoint['bytes_sent'] += metrics.bytes_sent
+            endpoint['bytes_received'] += metrics.bytes_received
+            status = metrics.error or metrics.status
+            endpoint['statuses'][status] = endpoint['statuses'].get(status, 0) + 1
+
+        for name in self.TIMES:
+            value = getattr(metrics, name)
+            if value is not None:
+                endpoint[name].add(value)
+
+    def snapshot(self):
+        '''
+        Get current counters and latency summaries for all endpoints
+
+        :rtype: dict
+        '''
+        with self.__lock:
+            endpoints = dict((key, dict(endpoint, statuses=dict(endpoint['statuses'])))
+                             for key, endpoint in self.__endpoints.iteritems())
+
+        for endpoint in endpoints.itervalues():
+            for name in self.TIMES:
+                endpoint[name] = endpoint[name].snapshot()
 
-def parse_since(since):
-    if not since:
-        return 0
+        return endpoints
 
-    if isinstance(since, (long, int)):
-        return since + time.time() if since < 0 else since
+    def dump(self, f):
+        '''
+        Write current metrics of all endpoints to file as JSON
+        '''
+        json.dump(self.snapshot(), f, indent=2, sort_keys=True)
 
-    if isinstance(since, datetime.date):
-        return since.strftime('%s')
+    def reset(self):
+        with self.__lock:
+            self.__endpoints = {}
 
-    if isinstance(since, datetime.timedelta):
-        return (datetime.datetime.now() - since).strftime('%s')
+class LineExporter(object):
+    '''
+    Writes every request metrics as a JSON line to a file or a socket (a `Session` hook)
 
-    try:
-        since = int(since)
-        return since + time.time() if since < 0 else since
+    The target is either a file path (appended to), a file-like object,
+    or a (host, port) address to send UDP datagrams (one line each) to.
+    '''
+    def __init__(self, target):
+        self.__lock = threading.Lock()
+        self.__file = self.__sock = None
+
+        if isinstance(target, tuple):
+            self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.__addr = target
+        elif isinstance(target, basestring):
+            self.__file = open(os.path.expanduser(target), 'a')
+        else:
+            self.__file = target
 
-    except ValueError:
-        from dateutil.parser import parse
-        return parse(since).strftime('%s')
+    def __call__(self, metrics):
+        line = json.dumps(dict(metrics._asdict(), time=time.time()), sort_keys=True) + '\n'
+        with self.__lock:
+            if self.__sock is not None:
+                self.__sock.sendto(line, self.__addr)
+            else:
+                self.__file.write(line)
+                self.__file.flush()
+
+    def close(self):
+        with self.__lock:
+            if self.__sock is not None:
+                self.__sock.close()
+            elif self.__file is not None:
+                self.__file.close()
 
+# }}}
 
 # Events {{{
 class Event(object):
@@ -254,19 +1466,42 @@ class NopEvent(Event):
 class TickleEvent(Event):
     '''
     Tickle event (user pushes)
+
+    If pushes were already fetched by stream (see `PushBullet.stream()` `coalesce` parameter),
+    they are kept in `fetched` list and no requests are made to get them.
     '''
-    __slots__ = ['api', 'time', 'since', 'subtype']
-    def __init__(self, api, subtype, since):
+    __slots__ = ['api', 'time', 'since', 'subtype', 'cursor', 'fetched']
+    def __init__(self, api, subtype, since, cursor=None, fetched=None):
         Event.__init__(self, api)
         self.subtype = subtype
         self.since = since
+        self.cursor = cursor
+        self.fetched = fetched
 
     def pushes(self, skip_empty=False, limit=None):
-        return self.api.pushes(since=self.since, skip_empty=skip_empty, limit=limit)
+        if self.fetched is not None:
+            pushes = (p for p in self.fetched if not skip_empty or p.get('type'))
+            return itertools.islice(pushes, limit)
+
+        pushes = self.api.stream_stats.pushes(
+                self.api.pushes(since=self.since, skip_empty=skip_empty, limit=limit), self.time)
+        return self.cursor.track(pushes) if self.cursor else pushes
 
     def __repr__(self):
         return '<%s[%s] @%s>' % (self.__class__.__name__, self.subtype, self.time)
 
+class ReconnectEvent(TickleEvent):
+    '''
+    Stream reconnect event (pushes missed while stream was disconnected)
+    '''
+    __slots__ = ['api', 'time', 'since', 'subtype', 'cursor', 'fetched']
+    def __init__(self, api, since, missed, cursor=None):
+        TickleEvent.__init__(self, api, 'push', since, cursor, missed)
+
+    @property
+    def missed(self):
+        return self.fetched
+
 class PushEvent(Event):
     '''
     Push event (device notification mirroring)
@@ -282,6 +1517,58 @@ class PushEvent(Event):
     def pushes(self, skip_empty=False, limit=None):
         yield self.push
 
+class StreamCursor(object):
+    '''
+    Position in user's pushes history as seen by event stream consumers
+
+    Tracks the latest seen push modification time (to fetch missed pushes from)
+    and recently seen push versions (to drop duplicates).
+    '''
+    def __init__(self, modified=None, size=1000):
+        self.modified = modified
+        self.size = size
+        self.__seen = set()
+        self.__order = collections.deque()
+        self.__lock = threading.Lock()
+
+    def observe(self, push):
+        '''
+        Record push as seen, return False if this very push version was already seen
+        '''
+        modified = push.get('modified')
+        key = (push.get('iden'), modified)
+
+        with self.__lock:
+            if modified is not None and (self.modified is None or modified > self.modified):
+                self.modified = modified
+
+            if key[0] is None:
+                return True
+
+            if key in self.__seen:
+                return False
+
+            self.__seen.add(key)
+            self.__order.append(key)
+            if len(self.__order) > self.size:
+                self.__seen.discard(self.__order.popleft())
+
+            return True
+
+    def track(self, pushes):
+        '''
+        Record pushes as seen while iterating over them
+        '''
+        for push in pushes:
+            self.observe(push)
+            yield push
+
+    def missed(self, pushes):
+        '''
+        Filter out pushes already seen
+        '''
+        return [push for push in pushes if self.observe(push)]
+
 # }}}
 
 class PushBulletError(Exception):
@@ -292,9 +1579,16 @@ class PushBulletObject(object):
     Abstract Pushbullet object for given REST endpoint
     '''
 
+    __slots__ = ()
     collection_name = None
 
     def __init__(self, **data):
+        self._update(data)
+
+    def _update(self, data):
+        '''
+        Update object fields from raw API data
+        '''
         self.__dict__.update(data)
 
     @property
@@ -329,7 +1623,7 @@ class PushBulletObject(object):
         return bool(getattr(self, 'api', None))
 
     def reload(self):
-        self.__dict__.update(self.api.get(self.uri))
+        self._update(self.api.get(self.uri))
         return self
 
     @classmethod
@@ -458,7 +1752,7 @@ class PushTarget(PushBulletObject):
         push.send(self)
         return push
 
-class Channel(PushTarget, ObjectWithIden):
+class Channel(ObjectWithIden, PushTarget):
     '''
     Channel to push to
     '''
@@ -506,7 +1800,7 @@ class Channel(PushTarget, ObjectWithIden):
     def subscribe(self):
         return Subscription(self.api, None).create(self.tag)
 
-class Client(PushTarget, ObjectWithIden):
+class Client(ObjectWithIden, PushTarget):
     '''
     Current user's OAuth client
 
@@ -681,10 +1975,98 @@ class User(PushTarget):
 class Push(PushBulletObject):
     '''
     Abstract push object
+
+    Pushes are compact: known API fields are stored in slots, and any unknown fields
+    go to a lazily created overflow dict, so there's no per-instance `__dict__`.
+    Subclasses must define `__slots__` too (use empty tuple if no new fields are needed).
     '''
-    type = None
+    FIELDS = ('iden', 'active', 'created', 'modified', 'dismissed', 'guid', 'direction',
+              'sender_iden', 'sender_email', 'sender_email_normalized', 'sender_name', 'sender_client_iden',
+              'receiver_iden', 'receiver_email', 'receiver_email_normalized',
+              'target_device_iden', 'source_device_iden', 'source_user_iden', 'client_iden', 'channel_iden',
+              'awake_app_guids', 'title', 'body', 'url', 'items', 'name', 'address',
+              'file_name', 'file_type', 'file_url', 'image_url', 'image_width', 'image_height',
+              'package_name', 'application_name', 'notification_id', 'notification_tag',
+              'conversation_iden', 'icon', 'dismissable', 'has_root')
+
+    __slots__ = FIELDS + ('api', '_extra')
     collection_name = 'pushes'
 
+    @property
+    def type(self):
+        '''
+        Push type (subclasses override it with a constant)
+        '''
+        try:
+            return self._extra['type']
+        except (AttributeError, KeyError):
+            return None
+
+    def _update(self, data):
+        for name, value in data.iteritems():
+            setattr(self, name, value)
+
+    def __setattr__(self, name, value):
+        try:
+            object.__setattr__(self, name, value)
+        except AttributeError:
+            # not a slot (or a read-only class constant like `type`)
+            if name == 'type' and value == type(self).type:
+                return
+
+            try:
+                extra = object.__getattribute__(self, '_extra')
+            except AttributeError:
+                extra = {}
+                object.__setattr__(self, '_extra', extra)
+            extra[name] = value
+
+    def __getattr__(self, name):
+        # called only if there's no slot value or class attribute with this name
+        try:
+            return object.__getattribute__(self, '_extra')[name]
+        except (AttributeError, KeyError):
+            raise AttributeError(name)
+
+    @classmethod
+    def _slot_names(cls):
+        try:
+            return cls.__dict__['_slot_names_cache']
+        except KeyError:
+            names = tuple(name for klass in reversed(cls.__mro__)
+                          for name in klass.__dict__.get('__slots__', ())
+                          if name != '_extra')
+            setattr(cls, '_slot_names_cache', names)
+            return names
+
+    def json(self):
+        data = {}
+        for name in self._slot_names():
+            try:
+                data[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+
+        if self.type is not None:
+            data['type'] = self.type
+
+        data.update(self.get('_extra') or {})
+        return data
+
+    def __copy__(self):
+        other = object.__new__(type(self))
+        for name in self._slot_names():
+            try:
+                object.__setattr__(other, name, object.__getattribute__(self, name))
+            except AttributeError:
+                pass
+
+        extra = self.get('_extra')
+        if extra:
+            object.__setattr__(other, '_extra', dict(extra))
+
+        return other
+
     @property
     def uri(self):
         return "pushes/%s" % self.iden
@@ -728,7 +2110,7 @@ class Push(PushBulletObject):
         data['type'] = self.type
 
         result = self.api.post('pushes', **data)
-        self.__dict__.update(result)
+        self._update(result)
 
     def resend(self):
         '''
@@ -740,7 +2122,7 @@ class Push(PushBulletObject):
         self.send(self.target_device_iden)
 
     def update(self):
-        self.__dict__.update(self.api.post(self.uri, dissmissed=getattr(self, 'dismissed', False)))
+        self._update(self.api.post(self.uri, dismissed=getattr(self, 'dismissed', False)))
         return self
 
     def dismiss(self):
@@ -792,6 +2174,7 @@ class NotePush(Push):
     '''
     Note push
     '''
+    __slots__ = ()
     type = 'note'
     def __init__(self, body='', title='', **data):
         '''
@@ -820,6 +2203,7 @@ class LinkPush(Push):
     '''
     Link push
     '''
+    __slots__ = ()
     type = 'link'
     def __init__(self, url, title='', body='', **data):
         '''
@@ -846,6 +2230,7 @@ class AddressPush(Push):
     '''
     Address push
     '''
+    __slots__ = ()
     type = 'address'
     def __init__(self, address, name='', **data):
         '''
@@ -871,6 +2256,7 @@ class ListPush(Push):
     '''
     List push
     '''
+    __slots__ = ()
     type = 'list'
     def __init__(self, items, title='', **data):
         '''
@@ -896,6 +2282,7 @@ class FilePush(Push):
     '''
     File push
     '''
+    __slots__ = ('file',)
     type = 'file'
     def __init__(self, file=None, file_name=None, file_type=None, body='', **data):
         '''
@@ -921,11 +2308,11 @@ class FilePush(Push):
         system stream without user-friendly name, like `sys.stdin`.
 
         The `file_type` argument is optional and must be a string in MIME-type format (e.g. `text/plain`).
-        If you omit it, file type will be deteremined by magic library by file's content, and if
-        autodetection will fail, file type will default to `application/octet-stream`.
-        The autodetection reads first 1024 bytes of file content and then resets file's seek cursor
-        to the beginning, so it won't work for non-seekable streams, so if you are about to push
-        something like `sys.stdin`, make sure you set `file_type` manually.
+        If you omit it, file type will be guessed by file name extension or deteremined by magic library
+        by file's content (see `MimeDetector`), and if autodetection will fail, file type will default
+        to `application/octet-stream`. The autodetection reads first 1024 bytes of file content and then
+        resets file's seek cursor back, or, for non-seekable streams like `sys.stdin`, replays
+        them before the rest of the stream during upload.
 
         :param file: file to push
         :type file: str, file, buffer, int, Path or any file-like or openable object
@@ -934,7 +2321,9 @@ class FilePush(Push):
         :param str body: optional message to accompany file
         '''
         assert(file or file_name)
-        self.file, self.file_name, self.file_type = file, utf8(file_name), utf8(file_type)
+        self.file = file
+        self.file_name = utf8(file_name) if file_name else None
+        self.file_type = utf8(file_type) if file_type else None
         if not self.file:
             self.file = self.file_name
 
@@ -946,36 +2335,60 @@ class FilePush(Push):
         if not isinstance(target, PushTarget):
             target = self.api.make_target(target)
 
-        if not self.file_url:  # file not uploaded yet
-            fh = (self.file if hasattr(self.file, 'read') else  # file-like object
-                  self.file.open('rb') if hasattr(self.file, 'open') else  # openable object
-                  os.fdopen(self.file, 'rb') if isinstance(self.file, int) else  # file descriptor
-                  StringIO(self.file) if isinstance(self.file, buffer) else  # in-memory file
-                  open(self.file, 'rb'))  # file name
+        self.upload(target.api)
+        Push.send(self, target)
 
-            try:
-                file_name = utf8(self.file_name) if self.file_name else os.path.basename(fh.name)
-                file_type = utf8(self.file_type) if self.file_type else self.guess_type(fh)
-                req = target.api.get('upload-request', file_name=file_name, file_type=file_type)
-                target.api.upload(req['upload_url'], data=req['data'], file=fh)
-                self.file_name, self.file_type, self.file_url = req['file_name'], req['file_type'], req['file_url']
+    def upload(self, api):
+        '''
+        Upload the file to PushBullet (does nothing if the file is already uploaded)
 
-            finally:
-                fh.close()
+        If the API object has upload cache enabled, and the same content with the same
+        name and type was uploaded before, cached file URL is used and no upload is done.
 
-        Push.send(self, target)
+        :param PushBullet api: API object to upload file with
+        '''
+        if self.file_url:
+            return
+
+        fh = (self.file if hasattr(self.file, 'read') else  # file-like object
+              self.file.open('rb') if hasattr(self.file, 'open') else  # openable object
+              os.fdopen(self.file, 'rb') if isinstance(self.file, int) else  # file descriptor
+              StringIO(self.file) if isinstance(self.file, buffer) else  # in-memory file
+              open(self.file, 'rb'))  # file name
 
-    def guess_type(self, file):
         try:
-            import magic
-            guesser = magic.open(magic.MIME_TYPE)
-            guesser.load()
-            mime_type = guesser.buffer(file.read(1024))
-            file.seek(0)
-            return mime_type or 'application/octet-stream'
+            file_name = utf8(self.file_name) if self.file_name else os.path.basename(fh.name)
+            if self.file_type:
+                file_type = utf8(self.file_type)
+            else:
+                file_type, fh = self.mime_detector.detect(fh, file_name)
+
+            cache = getattr(api, 'upload_cache', None)
+            if cache is not None:
+                digest, fh = cache.digest(fh)
+                key = cache.key(api.apikey, digest, file_name, file_type)
+                cached = cache.get(key)
+                if cached is not None:
+                    self.file_url, self.file_name, self.file_type = cached
+                    return
+
+            req = api.get('upload-request', file_name=file_name, file_type=file_type)
+            api.upload(req['upload_url'], data=req['data'], file=fh)
+            self.file_name, self.file_type, self.file_url = req['file_name'], req['file_type'], req['file_url']
 
-        except:
-            return 'application/octet-stream'
+            if cache is not None:
+                cache.set(key, self.file_url, self.file_name, self.file_type)
+
+        finally:
+            fh.close()
+
+    mime_detector = MimeDetector()
+
+    def guess_type(self, file):
+        '''
+        Detect MIME type of a seekable file (see `MimeDetector`)
+        '''
+        return self.mime_detector.detect(file, self.file_name)[0]
 
     @property
     def data(self):
@@ -988,6 +2401,7 @@ class MirrorPush(Push):
     '''
     Mirror push (internal usage only)
     '''
+    __slots__ = ()
     type = 'mirror'
 
     def decode(self):
@@ -1005,20 +2419,413 @@ class DismissalPush(Push):
     '''
     Dismissal push (internal usage only)
     '''
+    __slots__ = ()
     type = 'dismissal'
 
     def send(self, target):
         raise NotImplementedError
 
+PUSH_CLASSES = dict((cls.type, cls) for cls in (
+    NotePush, ListPush, LinkPush, FilePush, AddressPush, MirrorPush, DismissalPush))
+
 # }}}
 
 # Main API class {{{
 
+class Outcome(collections.namedtuple('Outcome', 'item result error')):
+    '''
+    Result of a single operation in a batch: either `result` or `error` is set
+    '''
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+def run_concurrently(func, items, concurrency=8):
+    '''
+    Call `func(item)` for every item on a bounded pool of worker threads
+
+    Errors don't stop the batch, they are reported in outcomes instead. Items are taken
+    from the iterable as workers get free (so calls start while lazy items, like pages
+    of pushes, are still fetched), if the iterable itself fails, the error is raised
+    after scheduled calls are done.
+
+    :param int concurrency: max number of calls running at once
+    :rtype: list of Outcome (in the same order as items)
+    '''
+    concurrency = max(1, concurrency)
+    workers = WorkerPool(concurrency, queue_size=concurrency)
+    try:
+        calls = [(item, workers.submit(func, item)) for item in items]
+        return [Outcome(item, None, future.exception()) if future.exception() else
+                Outcome(item, future.result(), None)
+                for item, future in calls]
+    finally:
+        workers.shutdown()
+
+class ResponseCache(object):
+    '''
+    LRU cache of GET responses with per-endpoint time-to-live
+
+    TTL for an URI is looked up by its longest prefix in `ttls` dict (e.g. `devices/<iden>`
+    uses `devices` TTL), URIs without TTL are never cached. Cached responses of an endpoint
+    are invalidated when POST or DELETE request is made to the same endpoint.
+    '''
+
+    TTLS = {
+            'users/me': 300,
+            'channel-info': 3600,
+            'devices': 60,
+            'contacts': 60,
+            'channels': 300,
+            'clients': 300,
+            'grants': 300,
+            'subscriptions': 300,
+            }
+
+    def __init__(self, ttls=None, size=1024):
+        '''
+        :param dict ttls: TTLs (in seconds) by endpoint to override defaults (use 0 to disable caching of endpoint)
+        :param int size: max number of responses to keep
+        '''
+        self.ttls = dict(self.TTLS, **(ttls or {}))
+        self.size = size
+        self.__lock = threading.Lock()
+        self.__entries = collections.OrderedDict()
+
+    def ttl(self, uri):
+        parts = uri.strip('/').split('/')
+        for i in xrange(len(parts), 0, -1):
+            ttl = self.ttls.get('/'.join(parts[:i]))
+            if ttl is not None:
+                return ttl
+        return 0
+
+    def key(self, uri, params):
+        return uri.strip('/'), tuple(sorted((k, v) for k, v in params.iteritems() if v is not None))
+
+    def get(self, uri, params):
+        '''
+        Get cached response (a copy of it, so it's safe to modify)
+
+        :raises KeyError: if response is not cached or expired
+        '''
+        key = self.key(uri, params)
+        with self.__lock:
+            expires, value = self.__entries.pop(key)
+            if expires < time.time():
+                raise KeyError(key)
+            self.__entries[key] = expires, value
+
+        return copy.deepcopy(value)
+
+    def set(self, uri, params, value):
+        ttl = self.ttl(uri)
+        if ttl <= 0:
+            return
+
+        key = self.key(uri, params)
+        value = copy.deepcopy(value)
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = time.time() + ttl, value
+            while len(self.__entries) > self.size:
+                self.__entries.popitem(last=False)
+
+    def invalidate(self, uri=None):
+        '''
+        Drop cached responses for the endpoint of given URI (all responses if uri is None)
+
+        Endpoint is the first part of the URI, so that changing `devices/<iden>`
+        also invalidates `devices` list.
+        '''
+        with self.__lock:
+            if uri is None:
+                self.__entries.clear()
+                return
+
+            endpoint = uri.strip('/').split('/')[0]
+            for key in [k for k in self.__entries if k[0].split('/')[0] == endpoint]:
+                del self.__entries[key]
+
+class ListCache(object):
+    '''
+    On-disk cache for lists of devices, contacts, channels etc
+
+    Lists are stored as JSON files (one per API key and collection)
+    and expire after `ttl` seconds.
+    '''
+
+    def __init__(self, path='~/.cache/pushbullet', ttl=300):
+        '''
+        :param str path: cache directory
+        :param float ttl: lists time-to-live (in seconds)
+        '''
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+
+    def filename(self, apikey, name):
+        return os.path.join(self.path, '%s-%s.json' % (
+            hashlib.sha1(utf8(apikey).encode('utf-8')).hexdigest()[:16], name))
+
+    def load(self, apikey, name):
+        '''
+        Load cached list of raw objects data
+
+        :returns: list of dicts or None if the list is not cached or expired
+        '''
+        filename = self.filename(apikey, name)
+        try:
+            if os.path.getmtime(filename) + self.ttl < time.time():
+                return None
+
+            with open(filename, 'rb') as f:
+                return json.load(f)
+
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, apikey, name, items):
+        filename = self.filename(apikey, name)
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path, 0o700)
+
+            fd, tmpname = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, 'wb') as f:
+                json.dump(items, f)
+            os.rename(tmpname, filename)
+
+        except (IOError, OSError):
+            pass  # cache is optional, never fail because of it
+
+    def invalidate(self, apikey, name):
+        try:
+            os.unlink(self.filename(apikey, name))
+        except OSError:
+            pass
+
+class UploadCache(object):
+    '''
+    On-disk cache of uploaded files
+
+    Maps API key (hashed, like in `ListCache`), file content digest, name and MIME type
+    to `file_url`, `file_name` and `file_type` returned by PushBullet after upload,
+    so the same file is never uploaded twice by the same account.
+    All entries are stored in a single JSON file and expire after `ttl` seconds.
+    '''
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, path='~/.cache/pushbullet/uploads.json', ttl=7 * 86400, size=1000):
+        '''
+        :param str path: cache file
+        :param float ttl: entries time-to-live (in seconds)
+        :param int size: max number of entries to keep
+        '''
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.ttl = ttl
+        self.size = size
+        self.__lock = threading.Lock()
+        self.__entries = None
+
+    @classmethod
+    def digest(cls, file):
+        '''
+        Calculate content digest of a file-like object
+
+        Seekable files are rewound back after reading, non-seekable streams are spooled
+        into a temporary file, so use the returned file object instead of the original one.
+
+        :returns: (hex digest, file object to read content from)
+        '''
+        pos = file_tell(file)
+        spool = None if pos is not None else tempfile.SpooledTemporaryFile(max_size=4 * 1024 * 1024)
+
+        digest = hashlib.sha1()
+        while True:
+            chunk = file.read(cls.CHUNK_SIZE)
+            if not chunk:  # file-like generators (see `FilelikeGenerator`) return None at EOF
+                break
+            digest.update(chunk)
+            if spool is not None:
+                spool.write(chunk)
+
+        if spool is None:
+            file.seek(pos)
+            return digest.hexdigest(), file
+
+        file.close()
+        spool.seek(0)
+        spool.name = getattr(file, 'name', None)
+        return digest.hexdigest(), spool
+
+    @staticmethod
+    def key(apikey, digest, file_name, file_type):
+        return u'%s:%s:%s:%s' % (hashlib.sha1(utf8(apikey).encode('utf-8')).hexdigest()[:16],
+                                 digest, utf8(file_type), utf8(file_name))
+
+    def __load(self):
+        if self.__entries is None:
+            try:
+                with open(self.path, 'rb') as f:
+                    self.__entries = json.load(f)
+            except (IOError, OSError, ValueError):
+                self.__entries = {}
+
+        return self.__entries
+
+    def __save(self):
+        now = time.time()
+        entries = sorted((e for e in self.__entries.iteritems() if e[1]['expires'] >= now),
+                key=lambda e: e[1]['expires'])[-self.size:]
+        self.__entries = dict(entries)
+
+        try:
+            dirname = os.path.dirname(self.path)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname, 0o700)
+
+            fd, tmpname = tempfile.mkstemp(dir=dirname)
+            with os.fdopen(fd, 'wb') as f:
+                json.dump(self.__entries, f)
+            os.rename(tmpname, self.path)
+
+        except (IOError, OSError):
+            pass  # cache is optional, never fail because of it
+
+    def get(self, key):
+        '''
+        Get uploaded file info
+
+        :returns: (file_url, file_name, file_type) or None if the file is not cached or expired
+        '''
+        with self.__lock:
+            entry = self.__load().get(key)
+
+        if entry is None or entry['expires'] < time.time():
+            return None
+
+        return entry['file_url'], entry['file_name'], entry['file_type']
+
+    def set(self, key, file_url, file_name, file_type):
+        with self.__lock:
+            self.__load()[key] = {
+                    'file_url': file_url,
+                    'file_name': file_name,
+                    'file_type': file_type,
+                    'expires': time.time() + self.ttl,
+                    }
+            self.__save()
+
+    def invalidate(self, key=None):
+        '''
+        Drop cached file info (or all of them if `key` is None)
+        '''
+        with self.__lock:
+            if key is None:
+                self.__entries = {}
+            else:
+                self.__load().pop(key, None)
+            self.__save()
+
+class TargetIndex(object):
+    '''
+    Index of push targets by iden, name, nickname, email and channel tag
+
+    Exact lookups are O(1) dict lookups, prefix lookups are done with
+    binary search over sorted (case-folded) keys.
+    '''
+
+    KEY_FIELDS = ('iden', 'nickname', 'name', 'email', 'email_normalized', 'tag')
+
+    def __init__(self, sources):
+        '''
+        :param sources: lists of targets to index (the index is outdated when any of these lists is replaced)
+        :type sources: tuple of list of PushTarget
+        '''
+        self.sources = tuple(sources)
+        self.__exact = {}
+        self.__folded = {}
+
+        for targets in self.sources:
+            for target in targets:
+                for key in self.keys(target):
+                    for index, _key in ((self.__exact, key), (self.__folded, key.lower())):
+                        found = index.setdefault(_key, [])
+                        if not any(t is target for t in found):
+                            found.append(target)
+
+        self.__sorted = sorted(self.__folded)
+
+    @classmethod
+    def keys(cls, target):
+        keys = set(utf8(getattr(target, name, None) or '') for name in cls.KEY_FIELDS)
+        try:
+            keys.add(utf8(target))
+        except AttributeError:
+            pass
+
+        keys.discard(u'')
+        return keys
+
+    def built_from(self, sources):
+        return len(sources) == len(self.sources) and all(a is b for a, b in zip(sources, self.sources))
+
+    def get(self, key):
+        '''
+        Find target by exact key (targets with matching iden take precedence)
+
+        :raises KeyError: if nothing is found
+        '''
+        key = utf8(key)
+        found = self.__exact[key]
+        return next((t for t in found if getattr(t, 'iden', None) == key), found[0])
+
+    def lookup(self, key):
+        '''
+        Find target by exact key, case-insensitive key or unique key prefix
+
+        :raises KeyError: if nothing is found
+        :raises PushBulletError: if key prefix is ambiguous
+        '''
+        try:
+            return self.get(key)
+        except KeyError:
+            pass
+
+        key = utf8(key).lower()
+        found = self.__folded.get(key)
+        if not found:
+            found = []
+            for _key in itertools.islice(self.__sorted, bisect.bisect_left(self.__sorted, key), None):
+                if not _key.startswith(key):
+                    break
+                found.extend(t for t in self.__folded[_key] if not any(t is f for f in found))
+
+        if not found:
+            raise KeyError(key)
+
+        if len(found) > 1:
+            raise PushBulletError(u'ambiguous target %s: %s' % (key, u', '.join(utf8(t) for t in found)))
+
+        return found[0]
+
 def cached_list_method(cls):
     cache_key = '_%s' % cls.collection_name
     def wrapper(self, reset_cache=False):
         if reset_cache or getattr(self, cache_key, None) is None:
-            setattr(self, cache_key, list(cls.iterate(self)))
+            items = None
+            if self.list_cache is not None and not reset_cache:
+                items = self.list_cache.load(self.apikey, cls.collection_name)
+
+            if items is None:
+                items = [o for o in self.paged(cls.collection_name, modified_after=0) if o.get('active', False)]
+                if self.list_cache is not None:
+                    self.list_cache.save(self.apikey, cls.collection_name, items)
+
+            setattr(self, cache_key, [cls(self, **o) for o in items])
         return getattr(self, cache_key)
     return wrapper
 
@@ -1034,14 +2841,31 @@ class PushBullet(PushTarget):
 
     API_URL = 'https://api.pushbullet.com/v2/%s'
 
-    def __init__(self, apikey):
+    def __init__(self, apikey, pool=None, rate_limiter=None, retry=None, cache=None, list_cache=None, hooks=None,
+                 upload_cache=None):
         '''
         Initialize API object (get API key from https://www.pushbullet.com/account)
 
         :param str apikey: API key (get at https://www.pushbullet.com/account)
+        :param ConnectionPool pool: keep-alive connections pool (can be shared by several API objects)
+        :param RateLimiter rate_limiter: requests pacer (share it between API objects with the same key)
+        :param RetryPolicy retry: rules to retry failed requests
+        :param cache: GET responses cache (use True to enable cache with default TTLs)
+        :type cache: ResponseCache|bool|None
+        :param list_cache: on-disk cache for `devices()`, `contacts()` etc (use True to enable cache with default TTL)
+        :type list_cache: ListCache|bool|None
+        :param hooks: callables to call with `RequestMetrics` after every HTTP request (see `MetricsAggregator`)
+        :type hooks: list of callable
+        :param upload_cache: on-disk cache of uploaded files, to skip uploading the same file again
+                             (use True to enable cache with default TTL)
+        :type upload_cache: UploadCache|bool|None
         '''
         self.apikey = apikey
-        self.sess = Session()
+        self.sess = Session(pool, rate_limiter, retry, hooks)
+        self.cache = ResponseCache() if cache is True else cache or None
+        self.list_cache = ListCache() if list_cache is True else list_cache or None
+        self.upload_cache = UploadCache() if upload_cache is True else upload_cache or None
+        self.stream_stats = StreamStats()
         self.sess.auth = (apikey, '')
 
     def get_type_by_args(self, args, arg=None):
@@ -1088,15 +2912,7 @@ class PushBullet(PushTarget):
         :param dict pushargs: a dict of parameters to compose a push object
         '''
         # a set of arguments in a dictionary
-        pushcls = {
-                'note': NotePush,
-                'list': ListPush,
-                'link': LinkPush,
-                'file': FilePush,
-                'address': AddressPush,
-                'mirror': MirrorPush,
-                'dismissal': DismissalPush,
-                }.get(self.get_type_by_args(pushargs, pusharg), Push)
+        pushcls = PUSH_CLASSES.get(self.get_type_by_args(pushargs, pusharg), Push)
         push = pushcls(pusharg, **pushargs) if pusharg else pushcls(**pushargs)
 
         return push.bind(self)
@@ -1105,17 +2921,23 @@ class PushBullet(PushTarget):
         '''
         Helper method for DELETE requests to API
         '''
-        self.sess.delete(self.API_URL % _uri).raise_for_status()
+        self._invalidate(_uri)
+        response = self.sess.delete(self.API_URL % _uri)
+        response.raise_for_status()
+        response.release()
+        self._invalidate(_uri)  # drop responses cached by concurrent requests while this one was in flight
 
     def post(self, _uri, **data):
         '''
         Helper method for POST requests to API
         '''
+        self._invalidate(_uri)
         response = self.sess.post(self.API_URL % _uri, data=json.dumps(data),
                 headers={'Content-Type': 'application/json'})
         response.raise_for_status()
 
         result = response.json()
+        self._invalidate(_uri)  # drop responses cached by concurrent requests while this one was in flight
 
         if 'error' in result:
             raise PushBulletError(result['message'])
@@ -1125,7 +2947,15 @@ class PushBullet(PushTarget):
     def get(self, _uri, **params):
         '''
         Helper method for GET requests to API
+
+        Responses are cached if the API object has response cache enabled.
         '''
+        if self.cache is not None:
+            try:
+                return self.cache.get(_uri, params)
+            except KeyError:
+                pass
+
         response = self.sess.get(self.API_URL % _uri, params=params)
         response.raise_for_status()
 
@@ -1134,25 +2964,169 @@ class PushBullet(PushTarget):
         if 'error' in result:
             raise PushBulletError(result['message'])
 
+        if self.cache is not None:
+            self.cache.set(_uri, params, result)
+
         return result
 
+    def _get_items(self, _uri, members, **params):
+        '''
+        Helper method for GET requests to API collections
+
+        Generator makes request when iteration starts and yields collection items decoded
+        as response arrives. Other response members (like `cursor`) are put into `members` dict.
+        If the connection fails in the middle of response body, the request is retried according
+        to session's retry policy, and items already yielded are skipped. If it still fails,
+        the exception gets `cursor` attribute of requested page. The response is closed
+        if iteration is stopped early.
+        '''
+        retry = self.sess.retry
+        seen, attempt, started = set(), 0, time.time()
+        while True:
+            response = None
+            try:
+                response = self.sess.get(self.API_URL % _uri, params=params)
+                response.raise_for_status()
+
+                for item in response.iter_json(_uri, members):
+                    iden = item.get('iden') if isinstance(item, dict) else None
+                    if iden is not None:
+                        if iden in seen:
+                            continue
+                        seen.add(iden)
+                    yield item
+
+                if 'error' in members:
+                    raise PushBulletError(members['message'])
+                return
+
+            except retry.exceptions as e:
+                if not retry.allows('GET', attempt, started):
+                    if 'cursor' in params:
+                        e.cursor = params['cursor']
+                    raise
+
+            except Exception as e:
+                if 'cursor' in params:
+                    e.cursor = params['cursor']
+                raise
+
+            finally:
+                if response is not None:
+                    response.close()
+
+            time.sleep(retry.delay(attempt))
+            attempt += 1
+            members.clear()
+
+    def _invalidate(self, _uri):
+        '''
+        Drop cached data which can be changed by a request to given URI
+        '''
+        if self.cache is not None:
+            self.cache.invalidate(_uri)
+
+        collection_name = _uri.strip('/').split('/')[0]
+        if collection_name not in self.LIST_COLLECTIONS:
+            return  # pushes etc are not list-cached
+
+        self.__dict__.pop('_%s' % collection_name, None)
+        if self.list_cache is not None:
+            self.list_cache.invalidate(self.apikey, collection_name)
+
     def upload(self, _uri, data, **files):
         '''
         Helper method to upload a file to given URL
+
+        Uploads are retried like idempotent requests (the same file is uploaded to the same URL),
+        unless the file is not seekable.
+        '''
+        response = self.sess.post(_uri, data=data, files=files, auth=(), idempotent=True)
+        response.raise_for_status()
+        response.release()
+
+    PAGE_LIMITS = (10, 500)
+    PAGE_TIME = 0.5
+
+    STREAM_URL = 'wss://stream.pushbullet.com/websocket/%s'
+
+    def paged(self, _uri, prefetch=0, **params):
         '''
-        response = self.sess.post(_uri, data=data, files=files, auth=()).raise_for_status()
+        Generator fetches and yields all items of a collection page by page
+
+        Failed page requests are retried according to session's retry policy.
+        If a page still can't be fetched, the exception gets `cursor` attribute,
+        so you can resume iteration later from the same page with
+        `api.paged(_uri, cursor=e.cursor)`.
+
+        With `prefetch` > 0 pages are fetched and decoded in background while you iterate
+        over items, keeping up to `prefetch` pages ready. In this mode page size
+        adapts to measured latency: it grows while pages take less than `PAGE_TIME`
+        seconds to fetch and shrinks when they take longer (within `PAGE_LIMITS`).
+        Prefetching pays off only if processing of items waits for I/O: pages are
+        chained by cursors, so they can't be fetched in parallel, and decoding them
+        competes for GIL with CPU bound processing, which makes it slower.
+
+        :param int prefetch: number of pages to fetch ahead
+        '''
+        pages = self._pages(_uri, params, adaptive=prefetch > 0)
+        if prefetch > 0:
+            pages = BackgroundIterator(pages, prefetch)
+
+        items = ()
+        try:
+            for items in pages:
+                for item in items:
+                    yield item
+        finally:
+            if hasattr(items, 'close'):
+                items.close()
+            if prefetch > 0:
+                pages.close()
+
+    def _pages(self, _uri, params, adaptive=False):
+        '''
+        Generator yields pages' items
 
-    def paged(self, _uri, **params):
-        page = self.get(_uri, **params)
+        Items of a page are decoded incrementally as they arrive (unless page is cached),
+        so the next page cursor is known only after they all are consumed. Pages to be prefetched
+        in background are decoded the same way, but as a whole.
+        '''
+        limit = params.get('limit')
+        while True:
+            started = time.time()
+            if self.cache is not None:
+                try:
+                    page = self.get(_uri, **params)
+                except Exception as e:
+                    if 'cursor' in params:
+                        e.cursor = params['cursor']
+                    raise
+                items = page[_uri]
+            else:
+                page = {}
+                items = self._get_items(_uri, page, **params)
+                if adaptive:
+                    items = list(items)  # decode in background to get next page cursor
 
-        while True:
-            for item in page[_uri]:
-                yield item
+            yield items
 
-            if not page.get('cursor'):
+            cursor = page.get('cursor')
+            if not cursor:
                 break
 
-            page = self.get(_uri, cursor=page['cursor'])
+            if adaptive:
+                limit = self.page_limit(limit or len(items), time.time() - started)
+
+            params = {'cursor': cursor, 'limit': limit}
+
+    def page_limit(self, limit, elapsed):
+        '''
+        Get next page size based on current page size and its fetch time
+        '''
+        min_limit, max_limit = self.PAGE_LIMITS
+        scale = min(2.0, max(0.5, self.PAGE_TIME / max(elapsed, 0.001)))
+        return int(min(max_limit, max(min_limit, limit * scale)))
 
     def subscribe(self, channel_tag):
         return Subscription(self, None).create(channel_tag)
@@ -1191,7 +3165,9 @@ class PushBullet(PushTarget):
     channels = cached_list_method(Channel)
     subscriptions = cached_list_method(Subscription)
 
-    def pushes(self, since=0, skip_empty=True, limit=None):
+    LIST_COLLECTIONS = frozenset(cls.collection_name for cls in (Contact, Device, Grant, Client, Channel, Subscription))
+
+    def pushes(self, since=0, skip_empty=True, limit=None, prefetch=0, raw=False, fields=None):
         '''
         Generator fetches and yields all pushes since given timestamp
 
@@ -1207,16 +3183,33 @@ class PushBullet(PushTarget):
         (so `timedelta(days=7)` means "pushes for the last week").
         If it is a string, it is parsed with dateutil.parser.parse() for datetime object.
 
+        If you only need to count or filter pushes, use `raw=True` to get raw dicts
+        as returned by API instead of push objects (which is several times faster),
+        and optionally `fields` to keep only given fields in these dicts.
+        You can always turn a raw push into an object later with `api.make_push(data)`.
+
         :param since: minimal time for pushes to fetch
         :type since: int|long|date|datetime|timedelta
         :param bool skip_empty: skip empty (inactive, removed) pushes, default is True
         :param int limit: limit number of items per page
+        :param int prefetch: number of pages to fetch in background ahead of iteration (see `paged()`)
+        :param bool raw: yield raw dicts instead of push objects
+        :param fields: fields to keep in raw dicts (all fields by default)
+        :type fields: list of str
         :rtype: generator
         '''
         it = self.paged(Push.collection_name,
+                prefetch=prefetch,
                 modified_after=parse_since(since),
                 limit=limit)
 
+        if raw:
+            if skip_empty:
+                it = (o for o in it if o.get('type'))
+            if fields:
+                it = (dict((k, o[k]) for k in fields if k in o) for o in it)
+            return it
+
         if skip_empty:
             return (self.make_push(o) for o in it if bool(o.get('type', None)))
         else:
@@ -1236,13 +3229,36 @@ class PushBullet(PushTarget):
 
         :param str device_iden: a device iden
         '''
-        try:
-            return next(d for d in self.devices() if d.iden == device_iden)
-        except StopIteration:
-            try:
-                return next(d for d in self.devices() if utf8(d) == device_iden)
-            except StopIteration:
-                raise KeyError(device_iden)
+        return self.__index('_device_index', (self.devices(),)).get(device_iden)
+
+    def __index(self, name, sources):
+        index = self.__dict__.get(name)
+        if index is None or not index.built_from(sources):
+            index = self.__dict__[name] = TargetIndex(sources)
+        return index
+
+    def targets(self, reset_cache=False):
+        '''
+        Get index of all push targets: devices, contacts, channels and clients
+
+        The index is rebuilt whenever any of these cached lists is refreshed.
+
+        :param bool reset_cache: refetch all lists
+        :rtype: TargetIndex
+        '''
+        return self.__index('_target_index', (
+            self.devices(reset_cache), self.contacts(reset_cache),
+            self.channels(reset_cache), self.clients(reset_cache)))
+
+    def resolve_target(self, name):
+        '''
+        Find push target by iden, name, nickname, email, channel tag or unique prefix of any of them
+
+        :raises KeyError: if nothing is found
+        :raises PushBulletError: if the name is ambiguous
+        :rtype: PushTarget
+        '''
+        return self.targets().lookup(name)
 
     _me = None
     def me(self, reset_cache=False):
@@ -1263,9 +3279,34 @@ class PushBullet(PushTarget):
             return target
 
         target = utf8(target)
+        try:
+            # don't fetch target lists to push to plain iden or email, use the index only if it's
+            # already built or the target is a name (nickname, channel tag etc) which needs resolving
+            index = self.__dict__.get('_target_index')
+            if index is None and self.needs_resolving(target):
+                index = self.targets()
+            if index is not None:
+                return index.get(target)
+        except Exception:
+            pass
+
         return (Device(self, target) if '@' not in target else
                 Contact(self, None, email_normalized=target))
 
+    # idens are random alphanumeric strings, so they have both letters and digits,
+    # unlike most long nicknames and channel tags
+    IDEN_RE = re.compile(r'^(?=.*[0-9])(?=.*[A-Za-z])[A-Za-z0-9]{16,}$')
+
+    @classmethod
+    def needs_resolving(cls, target):
+        '''
+        Check if push target string is a name to look up (not an email or an iden)
+
+        Names which look like idens (like long alphanumeric channel tags with digits)
+        are still found by `make_target()` if the targets index is already built.
+        '''
+        return '@' not in target and not cls.IDEN_RE.match(target)
+
     def push(self, push=None, target=None, **pushargs):
         '''
         Send push to a target (to all devices by default)
@@ -1291,6 +3332,111 @@ class PushBullet(PushTarget):
         push.bind(self).send(target)
         return push
 
+    @property
+    def ratelimit(self):
+        '''
+        Remaining rate limit quota as reported by PushBullet (all fields are None until the first request)
+
+        :rtype: Quota
+        '''
+        return self.sess.rate_limiter.quota
+
+    def push_many(self, push=None, targets=(), concurrency=8, **pushargs):
+        '''
+        Send the same push to many targets at once
+
+        Pushes are sent concurrently by at most `concurrency` worker threads.
+        A file push is uploaded only once before sending it to targets.
+        Failure to push to one target doesn't stop pushing to the others,
+        check outcomes for errors instead.
+
+        :param Push push: a push object to push
+        :param targets: push targets (see `push()` for possible target values)
+        :param int concurrency: max number of pushes to send at once
+        :param dict pushargs: push arguments
+        :rtype: list of Outcome
+        :returns: an outcome for each target with a sent push as a result
+        '''
+        if not isinstance(push, Push):
+            push = self.make_push(pushargs, push)
+
+        push.bind(self)
+        if isinstance(push, FilePush):
+            push.upload(self)
+
+        targets = list(targets)
+        if any(not isinstance(target, PushTarget) and self.needs_resolving(utf8(target)) for target in targets):
+            try:
+                self.targets()  # build targets index once, before sending
+            except Exception:
+                pass  # targets will be taken as idens and emails
+
+        def send(target):
+            _push = copy.copy(push)
+            _push.send(target)
+            return _push
+
+        return run_concurrently(send, targets, concurrency)
+
+    def delete_pushes(self, pushes=None, since=0, type=None, predicate=None, concurrency=8):
+        '''
+        Delete many pushes at once
+
+        Pushes to delete are either given explicitly (as push objects or push idens),
+        or selected from pushes history since given time. In both cases they can be
+        filtered by push type (push idens have no type, so it can't be combined with them)
+        and any predicate function. To prevent deleting the whole
+        history by mistake, either pushes or at least one filter must be given
+        (use `predicate=lambda p: True` to really delete all pushes).
+
+        Pushes are deleted concurrently by at most `concurrency` worker threads,
+        all of them paced by API rate limiter. Failure to delete one push doesn't
+        stop deleting the others, check outcomes for errors instead.
+
+        :param pushes: pushes to delete (all pushes since `since` by default)
+        :type pushes: iterable of Push or str
+        :param since: minimal time for pushes to delete (see `pushes()`)
+        :param type: push type or types to delete (all types by default)
+        :type type: str|list of str
+        :param callable predicate: function to select pushes to delete
+        :param int concurrency: max number of pushes to delete at once
+        :raises ValueError: if neither pushes nor any filter is given, or type filter is given with push idens
+        :rtype: list of Outcome
+        '''
+        return run_concurrently(lambda push: push.delete(),
+                self._select_pushes(pushes, since, type, predicate), concurrency)
+
+    def dismiss_pushes(self, pushes=None, since=0, type=None, predicate=None, concurrency=8):
+        '''
+        Dismiss many pushes at once (see `delete_pushes()` for arguments)
+
+        Already dismissed pushes are skipped.
+
+        :rtype: list of Outcome
+        '''
+        return run_concurrently(lambda push: push.dismiss(),
+                (p for p in self._select_pushes(pushes, since, type, predicate) if not p.get('dismissed')),
+                concurrency)
+
+    def _select_pushes(self, pushes, since, type, predicate):
+        types = (type,) if isinstance(type, basestring) else type
+        if pushes is None:
+            if not (since or type or predicate):
+                # never wipe the whole history by an accidental call without arguments
+                raise ValueError('either pushes or at least one of since, type or predicate must be given')
+            pushes = self.pushes(since=since)
+
+        else:
+            pushes = (push if isinstance(push, Push) else Push(iden=utf8(push)).bind(self) for push in pushes)
+            if types:
+                # bare idens have no type to filter by, so check them all before anything is processed
+                pushes = list(pushes)
+                if any(push.type is None for push in pushes):
+                    raise ValueError('type filter can be applied to push objects only, not to push idens')
+
+        return (push for push in pushes
+                if (not types or push.type in types) and (predicate is None or predicate(push)))
+
     def bind(self, obj):
         '''
         Bind given object to the API
@@ -1315,7 +3461,7 @@ class PushBullet(PushTarget):
         '''
         return self
 
-    def stream(self, skip_nop=True, use_server_time=False, throttle=1):
+    def stream(self, skip_nop=True, use_server_time=False, throttle=1, reconnect=True, heartbeat=30, coalesce=None):
         '''
         Generator to listen for events on websocket and yield them
 
@@ -1328,29 +3474,177 @@ class PushBullet(PushTarget):
         To be able to run any other code at the same time, consider running the loop
         in some other (background) thread.
 
+        Pushbullet sends "nop" event every 30 seconds, so if nothing comes from websocket
+        for two `heartbeat` intervals, the connection is considered dead. Dead or dropped
+        connection is reestablished with backoff delays (see `RetryPolicy.delay()`),
+        and pushes modified while stream was disconnected are fetched once and yielded
+        as a single `ReconnectEvent` (pushes already seen by consumers are dropped).
+
+        If `coalesce` window is set, push tickles arriving within this many seconds
+        after the first one are merged: new pushes are fetched once (from the last seen
+        push modification time) and yielded as a single `TickleEvent` with `fetched`
+        pushes, so every push is delivered exactly once. Tickles without new pushes
+        are not yielded at all. If the fetch fails, it's retried with backoff delays.
+
         :param bool skip_nop: skip "nop" events (used as keep-alive heartbeats only), default is True
         :param bool use_server_time: use server time to track last push to fetch (requires additional request on event), default is False
+        :param bool reconnect: reconnect on connection errors instead of raising them, default is True
+        :param float heartbeat: expected interval between "nop" events in seconds, None to wait forever
+        :param float coalesce: push tickles coalescing window in seconds, default is None (no coalescing)
         :rtype: generator
         '''
-        from websocket import create_connection
-        conn = create_connection('wss://stream.pushbullet.com/websocket/%s' % self.apikey)
-        last_ts = ((self.latest_push_time() or time.time()) if use_server_time else time.time()) + throttle
+        import websocket
+        errors = (websocket.WebSocketException, socket.error, ValueError)
+        fetch_errors = (socket.error, ValueError, httplib.HTTPException, RuntimeError, PushBulletError)
+
+        stats = self.stream_stats
+        cursor = StreamCursor(self.latest_push_time() if use_server_time else None)
+        last_ts = ((cursor.modified or time.time()) if use_server_time else time.time()) + throttle
+        conn, attempt, disconnected = None, 0, None
+        gap_since, gap_attempt, gap_retry_at = None, 0, 0
+        fetch_attempt = 0
+        frames = collections.deque()
 
-        while True:
-            event = json.loads(conn.recv())
-            evtype = event['type']
-            if skip_nop and evtype == 'nop':
-                continue
+        try:
+            while True:
+                if conn is None:
+                    try:
+                        conn = self.stream_connect(heartbeat)
+                    except errors:
+                        if not reconnect:
+                            raise
+                        time.sleep(self.sess.retry.delay(attempt))
+                        attempt += 1
+                        continue
+
+                    if disconnected is not None and gap_since is None:
+                        gap_since = cursor.modified or disconnected
+
+                # fill the gap after reconnect, if it fails (as REST API can be down too),
+                # retry with backoff on the next frames, not moving the cursor meanwhile
+                if gap_since is not None and time.time() >= gap_retry_at:
+                    received = time.time()
+                    try:
+                        pushes = list(stats.pushes(self.pushes(since=gap_since, skip_empty=False), received))
+                    except fetch_errors:
+                        if not reconnect:
+                            raise
+                        gap_retry_at = time.time() + self.sess.retry.delay(gap_attempt)
+                        gap_attempt += 1
+                    else:
+                        since, gap_since, gap_attempt = gap_since, None, 0
+                        missed = cursor.missed(pushes)
+                        last_ts = time.time() + throttle
+                        if missed:
+                            stats.yield_time.add(time.time() - received)
+                            yield ReconnectEvent(self, since, missed, cursor)
 
-            event = (NopEvent(self) if evtype == 'nop' else
-                     TickleEvent(self, event['subtype'], since=last_ts) if evtype == 'tickle' else
-                     PushEvent(self, self.make_push(event['push'])) if evtype == 'push' else
-                     None)
+                try:
+                    if frames:
+                        event, received = frames.popleft(), time.time()
+                    else:
+                        started = time.time()
+                        event = json.loads(conn.recv())
+                        received = time.time()
+                        stats.recv_time.add(received - started)
+
+                    if coalesce and event['type'] == 'tickle' and event['subtype'] == 'push':
+                        frames.extend(self._coalesce_frames(conn, coalesce))
+                        conn.settimeout(heartbeat and heartbeat * 2)
+
+                except errors:
+                    conn.shutdown()
+                    conn = None
+                    frames.clear()
+                    if not reconnect:
+                        raise
+                    if disconnected is None or attempt == 0:
+                        disconnected = last_ts - throttle
+                    continue
+
+                attempt = 0
+                evtype = event['type']
+                if skip_nop and evtype == 'nop':
+                    continue
+
+                if coalesce and evtype == 'tickle' and event['subtype'] == 'push':
+                    since = last_ts - throttle if cursor.modified is None else cursor.modified
+                    try:
+                        pushes = list(stats.pushes(self.pushes(since=since, skip_empty=False), received))
+                    except fetch_errors:
+                        if not reconnect:
+                            raise
+                        # keep the cursor, and retry the tickle with backoff
+                        time.sleep(self.sess.retry.delay(fetch_attempt))
+                        fetch_attempt += 1
+                        frames.appendleft(event)
+                        continue
+
+                    fetch_attempt = 0
+                    fetched = cursor.missed(pushes)
+                    last_ts = time.time() + throttle
+                    if fetched:
+                        stats.yield_time.add(time.time() - received)
+                        yield TickleEvent(self, 'push', since, cursor, fetched)
+                    continue
+
+                event = self.make_event(event, since=last_ts, cursor=cursor)
+                last_ts = ((event.latest_push_time() or time.time()) if use_server_time else time.time()) + throttle
+
+                if event:
+                    stats.yield_time.add(time.time() - received)
+                    yield event
+
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def stream_connect(self, heartbeat=30):
+        '''
+        Open websocket connection to events stream (see `stream()`)
+
+        :param float heartbeat: expected interval between "nop" events in seconds, None to wait forever
+        :rtype: websocket.WebSocket
+        '''
+        import websocket
+        return websocket.create_connection(self.STREAM_URL % self.apikey, timeout=heartbeat and heartbeat * 2)
+
+    def make_event(self, frame, since, cursor=None):
+        '''
+        Make event object from decoded websocket frame (None for unknown frames)
+
+        :param dict frame: websocket frame data
+        :param since: time to fetch pushes from for tickle events
+        :param StreamCursor cursor: stream cursor to track pushes seen by consumer
+        :rtype: Event
+        '''
+        evtype = frame['type']
+        return (NopEvent(self) if evtype == 'nop' else
+                TickleEvent(self, frame['subtype'], since=since, cursor=cursor) if evtype == 'tickle' else
+                PushEvent(self, self.make_push(frame['push'])) if evtype == 'push' else
+                None)
 
-            last_ts = ((event.latest_push_time() or time.time()) if use_server_time else time.time()) + throttle
+    def _coalesce_frames(self, conn, window):
+        '''
+        Read frames from websocket for given time window, drop push tickles and return other frames
+        '''
+        import websocket
+        frames = []
+        deadline = time.time() + window
+
+        while True:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                return frames
 
-            if event:
-                yield event
+            conn.settimeout(timeout)
+            try:
+                frame = json.loads(conn.recv())
+            except websocket.WebSocketTimeoutException:
+                return frames
+
+            if frame['type'] != 'tickle' or frame['subtype'] != 'push':
+                frames.append(frame)
 
     def latest_push_time(self):
         try:
@@ -1364,6 +3658,655 @@ class PushBullet(PushTarget):
 
 # }}}
 
+# Local push history {{{
+
+class PushStore(object):
+    '''
+    Local SQLite-backed copy of push history
+
+    The store is synced incrementally: only pushes modified since the last seen
+    `modified` timestamp are fetched from PushBullet, deleted pushes are removed and
+    dismissed pushes are updated. Pushes are then served from local database, e.g.::
+
+        store = PushStore(api, '~/.cache/pushbullet/pushes.db')
+        for push in store.pushes(since=-86400):  # cheap delta fetch + local query
+            print(push)
+    '''
+
+    def __init__(self, api, path=':memory:'):
+        '''
+        :param PushBullet api: API object to sync pushes with
+        :param str path: database file path (database is kept in memory by default)
+        '''
+        import sqlite3
+
+        self.api = api
+        self.__lock = threading.Lock()
+
+        if path != ':memory:':
+            path = os.path.expanduser(path)
+            if not os.path.isdir(os.path.dirname(path) or '.'):
+                os.makedirs(os.path.dirname(path))
+
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        with self.__db:
+            self.__db.execute('''CREATE TABLE IF NOT EXISTS pushes (
+                iden TEXT PRIMARY KEY,
+                modified REAL NOT NULL,
+                type TEXT,
+                data TEXT NOT NULL)''')
+            self.__db.execute('''CREATE INDEX IF NOT EXISTS pushes_modified ON pushes (modified)''')
+            self.__db.execute('''CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)''')
+
+    @property
+    def last_modified(self):
+        '''
+        Highest `modified` timestamp seen during syncs (0 if the store was never synced)
+        '''
+        with self.__lock:
+            row = self.__db.execute("SELECT value FROM meta WHERE key = 'modified'").fetchone()
+        return row[0] if row else 0
+
+    def sync(self):
+        '''
+        Fetch pushes changed since the last sync and apply changes to the store
+
+        Changes are applied atomically: if fetching fails, the store stays as it was before sync.
+
+        :returns: number of changed pushes
+        '''
+        since = self.last_modified
+        changes = list(self.api.paged(Push.collection_name, modified_after=since or None))
+        if not changes:
+            return 0
+
+        with self.__lock:
+            with self.__db:
+                for item in changes:
+                    if item.get('active', True):
+                        self.__db.execute('''INSERT OR REPLACE INTO pushes (iden, modified, type, data) VALUES (?, ?, ?, ?)''',
+                                (item['iden'], item['modified'], item.get('type'), json.dumps(item)))
+                    else:
+                        self.__db.execute('''DELETE FROM pushes WHERE iden = ?''', (item['iden'],))
+
+                self.__db.execute('''INSERT OR REPLACE INTO meta (key, value) VALUES ('modified', ?)''',
+                        (max(since, max(item['modified'] for item in changes)),))
+
+        return len(changes)
+
+    def pushes(self, since=0, skip_empty=True, sync=True):
+        '''
+        Get pushes since given time from local store (see `PushBullet.pushes()`)
+
+        :param since: minimal time for pushes to get
+        :type since: int|long|date|datetime|timedelta
+        :param bool skip_empty: skip empty (typeless) pushes, default is True
+        :param bool sync: fetch changes from PushBullet before querying, default is True
+        :rtype: generator
+        '''
+        if sync:
+            self.sync()
+
+        with self.__lock:
+            rows = self.__db.execute('''SELECT data FROM pushes WHERE modified > ? %s ORDER BY modified DESC''' % (
+                'AND type IS NOT NULL' if skip_empty else ''), (float(parse_since(since)),)).fetchall()
+
+        return (self.api.make_push(json.loads(data)) for data, in rows)
+
+    def __len__(self):
+        with self.__lock:
+            return self.__db.execute('''SELECT COUNT(*) FROM pushes''').fetchone()[0]
+
+    def clear(self):
+        '''
+        Drop all stored pushes (next sync will fetch full history)
+        '''
+        with self.__lock:
+            with self.__db:
+                self.__db.execute('''DELETE FROM pushes''')
+                self.__db.execute('''DELETE FROM meta''')
+
+    def close(self):
+        self.__db.close()
+
+# }}}
+
+# Async API {{{
+
+class AsyncPushBullet(object):
+    '''
+    Non-blocking facade for PushBullet API
+
+    Every call is run on a bounded pool of worker threads and returns a `Future`
+    immediately, so a single thread can keep lots of requests in flight, e.g.::
+
+        api = AsyncPushBullet(apikey)
+        futures = [api.push(body='hello', target=device) for device in devices]
+        pushes = [f.result() for f in futures]
+
+    Objects returned by futures are bound to the underlying (blocking) `PushBullet` object
+    available as `api.sync`.
+    '''
+
+    def __init__(self, apikey, workers=16, pool=None):
+        '''
+        :param apikey: API key or `PushBullet` object to wrap
+        :type apikey: str|PushBullet
+        :param int workers: number of worker threads (max number of requests in flight)
+        :param ConnectionPool pool: keep-alive connections pool, by default keeps one connection per worker
+        '''
+        self.sync = (apikey if isinstance(apikey, PushBullet) else
+                     PushBullet(apikey, pool=pool or ConnectionPool(size=workers)))
+        self.workers = WorkerPool(workers)
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Run any blocking call on the worker pool
+
+        :rtype: Future
+        '''
+        return self.workers.submit(func, *args, **kwargs)
+
+    def get(self, _uri, **params):
+        return self.submit(self.sync.get, _uri, **params)
+
+    def post(self, _uri, **data):
+        return self.submit(self.sync.post, _uri, **data)
+
+    def delete(self, _uri):
+        return self.submit(self.sync.delete, _uri)
+
+    def upload(self, _uri, data, **files):
+        return self.submit(self.sync.upload, _uri, data, **files)
+
+    def push(self, push=None, target=None, **pushargs):
+        '''
+        Send push to a target (see `PushBullet.push()`)
+
+        :rtype: Future
+        '''
+        return self.submit(self.sync.push, push, target, **pushargs)
+
+    def me(self, reset_cache=False):
+        return self.submit(self.sync.me, reset_cache)
+
+    def devices(self, reset_cache=False):
+        return self.submit(self.sync.devices, reset_cache)
+
+    def contacts(self, reset_cache=False):
+        return self.submit(self.sync.contacts, reset_cache)
+
+    def channels(self, reset_cache=False):
+        return self.submit(self.sync.channels, reset_cache)
+
+    def clients(self, reset_cache=False):
+        return self.submit(self.sync.clients, reset_cache)
+
+    def grants(self, reset_cache=False):
+        return self.submit(self.sync.grants, reset_cache)
+
+    def subscriptions(self, reset_cache=False):
+        return self.submit(self.sync.subscriptions, reset_cache)
+
+    def pushes(self, since=0, skip_empty=True, limit=None, buffer_size=100):
+        '''
+        Iterator over pushes (see `PushBullet.pushes()`), fetched in background
+
+        :rtype: BackgroundIterator
+        '''
+        return BackgroundIterator(self.sync.pushes(since, skip_empty, limit), buffer_size)
+
+    def stream(self, buffer_size=100, **kwargs):
+        '''
+        Iterator over events (see `PushBullet.stream()`), read from websocket in background
+
+        :rtype: BackgroundIterator
+        '''
+        return BackgroundIterator(self.sync.stream(**kwargs), buffer_size)
+
+    def close(self):
+        '''
+        Stop worker threads and close idle connections
+        '''
+        self.workers.shutdown()
+        self.sync.sess.pool.clear()
+
+# }}}
+
+# Multi-account streams {{{
+
+class StreamMultiplexer(object):
+    '''
+    Events streams of many accounts served by a single thread
+
+    Websockets of all accounts are polled with `select()` in the iterating thread,
+    while connecting and fetching pushes on tickles run on a shared worker pool,
+    so any number of accounts is served by a fixed number of threads, e.g.::
+
+        mux = StreamMultiplexer([apikey1, apikey2, apikey3])
+        for api, event in mux:
+            print(api.apikey, event)
+
+    Push tickles are never yielded as is: new pushes are fetched for them in background
+    (see `PushBullet.stream()` `coalesce` parameter) and yielded as tickle events with
+    `fetched` pushes. Dropped and dead connections are reestablished the same way
+    `PushBullet.stream()` does it.
+    '''
+
+    class Account(object):
+        '''
+        Stream state of an account
+        '''
+        __slots__ = ['api', 'conn', 'cursor', 'since', 'received', 'attempt', 'retry_at',
+                     'connecting', 'disconnected', 'fetching', 'fetch_at', 'dirty', 'failures', 'tickled']
+
+        def __init__(self, api):
+            self.api = api
+            self.conn = None
+            self.cursor = StreamCursor()
+            self.since = time.time()
+            self.received = None
+            self.attempt = 0
+            self.retry_at = 0
+            self.connecting = False
+            self.disconnected = None
+            self.fetching = False
+            self.fetch_at = None
+            self.dirty = False
+            self.failures = 0
+            self.tickled = None
+
+        def __repr__(self):
+            return '<Account[%r]>' % self.api
+
+    def __init__(self, accounts, workers=8, pool=None, skip_nop=True, heartbeat=30, coalesce=0):
+        '''
+        :param accounts: API keys or `PushBullet` objects to listen events for
+        :type accounts: list of str|PushBullet
+        :param workers: number of worker threads or worker pool for connecting and fetching pushes
+        :type workers: int|WorkerPool
+        :param ConnectionPool pool: keep-alive connections pool shared by accounts given as API keys
+        :param bool skip_nop: skip "nop" events, default is True
+        :param float heartbeat: expected interval between "nop" events in seconds, None to wait forever
+        :param float coalesce: push tickles coalescing window in seconds, default is 0
+        '''
+        self.workers = workers if isinstance(workers, WorkerPool) else WorkerPool(workers)
+        self.pool = pool or ConnectionPool(size=self.workers.size)
+        self.skip_nop = skip_nop
+        self.heartbeat = heartbeat
+        self.coalesce = coalesce
+
+        self.__done = collections.deque()
+        self.__wakeup = os.pipe()
+
+        self.accounts = []
+        for account in accounts:
+            self.add(account)
+
+    def add(self, account):
+        '''
+        Add account to listen events for (can be called from any thread)
+
+        :type account: str|PushBullet
+        :rtype: PushBullet
+        '''
+        api = account if isinstance(account, PushBullet) else PushBullet(account, pool=self.pool)
+        self.accounts.append(self.Account(api))
+        os.write(self.__wakeup[1], b'.')
+        return api
+
+    def __iter__(self):
+        import websocket
+        errors = (websocket.WebSocketException, socket.error, ValueError)
+
+        while True:
+            now = time.time()
+
+            while self.__done:
+                account, kind, future = self.__done.popleft()
+                error = future.exception()
+
+                if kind == 'connect':
+                    account.connecting = False
+                    if error:
+                        self.__disconnect(account, now)
+                    else:
+                        account.conn, account.received = future.result(), now
+                        if account.disconnected is not None:
+                            since = account.cursor.modified or account.disconnected
+                            self.__submit(account, 'gap', self.__fetch_pushes, account, since, now)
+                            account.disconnected = None
+
+                else:
+                    if kind == 'fetch':
+                        account.fetching = False
+
+                    if error:
+                        account.dirty = True
+                        account.failures += 1
+                    else:
+                        account.failures = 0
+                        since, received, pushes = future.result()
+                        account.since = max(account.since, received)  # for tickles before any push is seen
+                        if pushes:
+                            account.api.stream_stats.yield_time.add(time.time() - received)
+                            yield account.api, (ReconnectEvent(account.api, since, pushes, account.cursor) if kind == 'gap' else
+                                                TickleEvent(account.api, 'push', since, account.cursor, pushes))
+
+                    if account.dirty and not account.fetching:
+                        account.dirty = False
+                        account.fetch_at = now + (account.api.sess.retry.delay(account.failures) if account.failures else 0)
+
+            timeout = self.heartbeat or 60
+            for account in list(self.accounts):
+                if account.conn is None:
+                    if not account.connecting and account.retry_at <= now:
+                        self.__connect(account)
+                    elif not account.connecting:
+                        timeout = min(timeout, account.retry_at - now)
+
+                elif self.heartbeat and now - account.received > self.heartbeat * 2:
+                    self.__disconnect(account, now)
+                    timeout = 0
+
+                elif self.heartbeat:
+                    timeout = min(timeout, account.received + self.heartbeat * 2 - now)
+
+                if account.fetch_at is not None and not account.fetching:
+                    if account.fetch_at <= now:
+                        self.__fetch(account)
+                    else:
+                        timeout = min(timeout, account.fetch_at - now)
+
+            conns = dict((account.conn.sock, account) for account in self.accounts if account.conn is not None)
+            ready = select.select(list(conns) + [self.__wakeup[0]], [], [], max(0, timeout))[0]
+
+            if self.__wakeup[0] in ready:
+                os.read(self.__wakeup[0], 4096)
+
+            now = time.time()
+            for sock in ready:
+                account = conns.get(sock)
+                if account is None or account.conn is None:
+                    continue
+
+                while True:
+                    try:
+                        frame = json.loads(account.conn.recv())
+                    except errors:
+                        self.__disconnect(account, now)
+                        break
+
+                    received = time.time()
+                    account.api.stream_stats.recv_time.add(received - now)
+                    account.received, account.attempt = received, 0
+                    event = self.__event(account, frame, received)
+                    if event:
+                        account.api.stream_stats.yield_time.add(time.time() - received)
+                        yield account.api, event
+
+                    if account.conn is None or not getattr(account.conn.sock, 'pending', lambda: 0)():
+                        break
+
+    def __event(self, account, frame, now):
+        if frame['type'] == 'nop' and self.skip_nop:
+            return None
+
+        if frame['type'] == 'tickle' and frame['subtype'] == 'push':
+            if account.tickled is None:
+                account.tickled = now
+            if account.fetching:
+                account.dirty = True
+            elif account.fetch_at is None:
+                account.fetch_at = now + self.coalesce
+            return None
+
+        return account.api.make_event(frame, since=account.since, cursor=account.cursor)
+
+    def __submit(self, account, kind, func, *args):
+        def done(future):
+            self.__done.append((account, kind, future))
+            os.write(self.__wakeup[1], b'.')
+
+        self.workers.submit(func, *args).add_done_callback(done)
+
+    def __connect(self, account):
+        account.connecting = True
+        self.__submit(account, 'connect', account.api.stream_connect, self.heartbeat)
+
+    def __disconnect(self, account, now):
+        if account.conn is not None:
+            self.__drop(account.conn)
+            account.conn = None
+            if account.disconnected is None:
+                account.disconnected = account.received or now
+
+        account.retry_at = now + account.api.sess.retry.delay(account.attempt)
+        account.attempt += 1
+
+    def __fetch(self, account):
+        account.fetching, account.fetch_at = True, None
+        since = account.since if account.cursor.modified is None else account.cursor.modified
+        received, account.tickled = account.tickled or time.time(), None
+        self.__submit(account, 'fetch', self.__fetch_pushes, account, since, received)
+
+    @staticmethod
+    def __fetch_pushes(account, since, received):
+        pushes = account.api.stream_stats.pushes(account.api.pushes(since=since, skip_empty=False), received)
+        return since, received, account.cursor.missed(pushes)
+
+    def close(self):
+        '''
+        Close all websocket connections (the multiplexer can't be used after that)
+        '''
+        for account in self.accounts:
+            if account.conn is not None:
+                self.__drop(account.conn)
+                account.conn = None
+
+        for fd in self.__wakeup:
+            os.close(fd)
+
+    @staticmethod
+    def __drop(conn):
+        # close websocket without closing handshake, which blocks on dead connections
+        try:
+            conn.sock.shutdown(socket.SHUT_RDWR)
+        except (socket.error, AttributeError):
+            pass
+        conn.shutdown()
+
+# }}}
+
+# Event dispatching {{{
+
+class EventDispatcher(object):
+    '''
+    Runs event and push handlers on a worker pool, so slow handlers don't delay reading events
+
+    Handlers are registered for event classes and push types, e.g.::
+
+        dispatcher = EventDispatcher(workers=4)
+
+        @dispatcher.on_push('note')
+        def show_note(push):
+            print(push.title)
+
+        dispatcher.run(api.stream())
+
+    Every handler gets its calls one by one in the order of events (different handlers
+    run concurrently). Pushes of events are fetched in background in the order of events too.
+    At most `queue_size` calls are pending at once, `dispatch()` blocks when the queue is full.
+    Push handler calls are queued by the background fetching and can't wait there without
+    stalling workers, so they are limited by `dispatch()` instead: it also blocks while
+    `queue_size` push handler calls and events to fetch pushes for are pending. Pushes of events
+    which are being fetched are still queued, so the queue can exceed the limit by that many.
+    '''
+
+    class Lane(object):
+        '''
+        Pending calls of a single handler
+        '''
+        __slots__ = ['handler', 'calls', 'running']
+
+        def __init__(self, handler):
+            self.handler = handler
+            self.calls = collections.deque()
+            self.running = False
+
+    def __init__(self, workers=4, queue_size=1000, skip_empty=True, on_error=None):
+        '''
+        :param workers: number of worker threads or worker pool to run handlers on
+        :type workers: int|WorkerPool
+        :param int queue_size: max number of pending handler calls
+        :param bool skip_empty: don't pass empty (deleted, inactive) pushes to push handlers, default is True
+        :param callable on_error: `on_error(handler, arg, error)` is called when handler fails, prints traceback by default
+        '''
+        self.workers = workers if isinstance(workers, WorkerPool) else WorkerPool(workers)
+        self.skip_empty = skip_empty
+        self.on_error = on_error or self.print_error
+
+        self.__event_handlers = []
+        self.__push_handlers = []
+        self.__lanes = {}
+        self.__fetch_lane = self.Lane(self.__dispatch_pushes)
+
+        self.queue_size = queue_size
+        self.__lock = threading.Lock()
+        self.__slots = threading.Semaphore(queue_size)
+        self.__pending = 0
+        self.__pending_pushes = 0
+        self.__idle = threading.Condition(self.__lock)
+
+    def on_event(self, event_class=Event, handler=None):
+        '''
+        Register `handler(event)` for events of given class (can be used as decorator)
+
+        :param type event_class: Event subclass (e.g. `TickleEvent`), all events by default
+        :param callable handler: event handler
+        '''
+        if handler is None:
+            return lambda handler: self.on_event(event_class, handler) or handler
+
+        self.__event_handlers.append((event_class, self.__lane(handler)))
+
+    def on_push(self, push_type=None, handler=None):
+        '''
+        Register `handler(push)` for pushes of given type (can be used as decorator)
+
+        :param push_type: push type name (e.g. "note") or Push subclass, all pushes by default
+        :type push_type: str|type
+        :param callable handler: push handler
+        '''
+        if handler is None:
+            return lambda handler: self.on_push(push_type, handler) or handler
+
+        self.__push_handlers.append((push_type, self.__lane(handler)))
+
+    def __lane(self, handler):
+        with self.__lock:
+            return self.__lanes.setdefault(handler, self.Lane(handler))
+
+    def dispatch(self, event):
+        '''
+        Schedule handlers for the event and its pushes (blocks while the queue is full)
+
+        :param Event event: event to dispatch
+        '''
+        for event_class, lane in self.__event_handlers:
+            if isinstance(event, event_class):
+                self.__schedule(lane, event)
+
+        if self.__push_handlers:
+            with self.__idle:
+                while self.__pending_pushes + len(self.__fetch_lane.calls) >= self.queue_size:
+                    self.__idle.wait()
+            self.__schedule(self.__fetch_lane, event)
+
+    def run(self, events):
+        '''
+        Dispatch all events from given iterable (e.g. `api.stream()`)
+        '''
+        for event in events:
+            self.dispatch(event)
+
+    def join(self):
+        '''
+        Wait until all pending handler calls are done
+        '''
+        with self.__idle:
+            while self.__pending:
+                self.__idle.wait()
+
+    def shutdown(self, wait=True):
+        '''
+        Stop worker threads (after pending handler calls are done if `wait` is True)
+        '''
+        if wait:
+            self.join()
+        self.workers.shutdown(wait)
+
+    def __dispatch_pushes(self, event):
+        for push in event.pushes(skip_empty=self.skip_empty):
+            for push_type, lane in self.__push_handlers:
+                if (push_type is None or
+                        (push_type == push.type if isinstance(push_type, basestring) else
+                         isinstance(push, push_type))):
+                    self.__schedule(lane, push, block=False)
+
+    def __schedule(self, lane, arg, block=True):
+        # push handler calls are scheduled from workers, so they are never blocked
+        # (otherwise workers waiting for free slots could stall the queue forever),
+        # dispatch() waits for them instead
+        if block:
+            self.__slots.acquire()
+
+        with self.__lock:
+            lane.calls.append((arg, block))
+            self.__pending += 1
+            if not block:
+                self.__pending_pushes += 1
+            if lane.running:
+                return
+            lane.running = True
+
+        self.workers.submit(self.__run, lane)
+
+    def __run(self, lane):
+        with self.__lock:
+            arg, blocked = lane.calls.popleft()
+
+        try:
+            lane.handler(arg)
+        except Exception as e:
+            self.on_error(lane.handler, arg, e)
+
+        if blocked:
+            self.__slots.release()
+
+        with self.__lock:
+            self.__pending -= 1
+            if not blocked:
+                self.__pending_pushes -= 1
+            if not self.__pending or not blocked:
+                self.__idle.notify_all()
+
+            if not lane.calls:
+                lane.running = False
+                return
+
+        self.workers.submit(self.__run, lane)
+
+    @staticmethod
+    def print_error(handler, arg, error):
+        '''
+        Default handler errors reporter (prints traceback to stderr)
+        '''
+        import traceback
+        traceback.print_exc()
+
+# }}}
+
 #import yaml
 #with open('/usr/local/etc/pushbullet.yml', 'rb') as f:
 #    config = yaml.safe_load(f)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python2
+'''
+Offline tests, run against local fake servers (see fakeserver.py), no API key needed
+
+Usage: python2 -m unittest -v test_offline
+'''
+
+import os
+import json
+import time
+import tempfile
+import httplib
+import unittest
+from StringIO import StringIO
+
+import pushybullet as pb
+from fakeserver import FakeServer, FakeStream
+
+
+def chunked(data, size):
+    '''
+    `read` function returning at most `size` bytes of data at once
+    '''
+    f = StringIO(data)
+    return lambda n: f.read(min(n, size))
+
+
+class JSONItemsDecoderTest(unittest.TestCase):
+    DOC = {
+            'pushes': [1.5, 2, -300.0, 12345678901234, 1e-7, True, False, None, u'caf\xe9 \u2603 \U0001f600',
+                       {'a': [1, 2.25, {'b': u'\u044f'}], 'c': ''}, [], {}],
+            'cursor': 'abc',
+            'count': 123,
+            }
+
+    def decode(self, text, size, key='pushes'):
+        decoder = pb.JSONItemsDecoder(chunked(text, size), chunk_size=size)
+        return list(decoder.iterate(key)), decoder.members
+
+    def test_chunk_boundaries(self):
+        for text in (json.dumps(self.DOC), json.dumps(self.DOC, ensure_ascii=False).encode('utf-8'),
+                     json.dumps(self.DOC, indent=1)):
+            for size in xrange(1, len(text) + 1):
+                items, members = self.decode(text, size)
+                self.assertEqual(items, self.DOC['pushes'], size)
+                self.assertEqual(members, {'cursor': 'abc', 'count': 123}, size)
+
+    def test_split_numbers(self):
+        text = '{"pushes":[1.5,2,1e5,-12.25e-1,123]}'
+        for size in xrange(1, len(text) + 1):
+            self.assertEqual(self.decode(text, size)[0], [1.5, 2, 1e5, -1.225, 123], size)
+
+    def test_number_before_end_of_stream(self):
+        self.assertEqual(self.decode('{"pushes":[],"count":12}', 1)[1], {'count': 12})
+        with self.assertRaises(ValueError):
+            self.decode('{"pushes":[1,2', 1)
+
+    def test_truncated_document(self):
+        text = json.dumps(self.DOC)
+        for end in (1, len(text) / 2, len(text) - 1):
+            with self.assertRaises(ValueError):
+                self.decode(text[:end], 7)
+
+    def test_empty_and_missing_array(self):
+        self.assertEqual(self.decode('{}', 1), ([], {}))
+        self.assertEqual(self.decode('{"pushes":[]}', 1), ([], {}))
+        self.assertEqual(self.decode('{"cursor":null}', 1), ([], {'cursor': None}))
+
+
+class PagingTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(page_size=50).start().seed(pushes=200)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_all_pages(self):
+        api = self.server.api()
+        idens = [p.iden for p in api.pushes()]
+        self.assertEqual(len(idens), 200)
+        self.assertEqual(len(set(idens)), 200)
+
+    def test_raw_and_prefetch(self):
+        api = self.server.api()
+        self.assertEqual([p['iden'] for p in api.pushes(raw=True)],
+                         [p.iden for p in api.pushes(prefetch=2)])
+
+    def test_failed_page_cursor(self):
+        api = self.server.api(retry=pb.RetryPolicy(total=0))
+        it = api.pushes()
+        for _ in xrange(60):
+            next(it)
+
+        self.server.error_rate = 1
+        with self.assertRaises(Exception) as ctx:
+            list(it)
+        self.assertTrue(getattr(ctx.exception, 'cursor', None))
+
+        self.server.error_rate = 0
+        rest = list(api.paged('pushes', cursor=ctx.exception.cursor))
+        self.assertEqual(len(rest), 100)
+
+    def test_truncated_pages_retried(self):
+        self.server.truncate_rate = 0.3
+        api = self.server.api(retry=pb.RetryPolicy(total=20, backoff=0.001))
+        idens = [p.iden for p in api.pushes()]
+        self.assertEqual(sorted(idens), sorted(p['iden'] for p in self.server.state.pushes))
+
+    def test_truncated_page_is_connection_error(self):
+        self.server.truncate_rate = 1
+        api = self.server.api(retry=pb.RetryPolicy(total=1, backoff=0.001))
+        with self.assertRaises(httplib.HTTPException) as ctx:
+            list(api.pushes())
+        self.assertFalse(isinstance(ctx.exception, ValueError))
+
+
+class TargetTest(unittest.TestCase):
+    def test_needs_resolving(self):
+        for target in ('ujpah72o0sjAoRtnM0jc', 'ujfake0000000001', 'friend@example.com'):
+            self.assertFalse(pb.PushBullet.needs_resolving(target), target)
+        for target in ('Chrome', 'MyFavouriteChannel', 'myfavouritechannel', 'ujpah72o0s', 'my-channel-2016'):
+            self.assertTrue(pb.PushBullet.needs_resolving(target), target)
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(page_size=50).start().seed(pushes=100)
+        for n in xrange(20):
+            self.server.state.add_push({'type': 'link', 'url': 'http://example.com/%d' % n})
+
+    def tearDown(self):
+        self.server.stop()
+
+    def active(self, type=None):
+        return [p['iden'] for p in self.server.state.pushes if p['active'] and (type is None or p['type'] == type)]
+
+    def test_delete_by_type(self):
+        outcomes = self.server.api().delete_pushes(type='link')
+        self.assertEqual(len(outcomes), 20)
+        self.assertTrue(all(o.ok for o in outcomes))
+        self.assertEqual(self.active('link'), [])
+        self.assertEqual(len(self.active('note')), 100)
+
+    def test_type_filter_with_idens(self):
+        api = self.server.api()
+        with self.assertRaises(ValueError):
+            api.delete_pushes(self.active('link'), type='link')
+        self.assertEqual(len(self.active()), 120)
+
+        idens = self.active('link')[:5]
+        outcomes = api.delete_pushes(idens)
+        self.assertEqual([o.item.iden for o in outcomes], idens)
+        self.assertEqual(len(self.active('link')), 15)
+
+    def test_run_concurrently_streams_items(self):
+        started = []
+        def items():
+            for n in xrange(100):
+                started.append(len(calls))
+                yield n
+
+        calls = []
+        outcomes = pb.run_concurrently(lambda n: calls.append(n) or 1.0 / (n % 10), items(), concurrency=4)
+        self.assertEqual([o.item for o in outcomes], range(100))
+        self.assertEqual([o.ok for o in outcomes], [n % 10 != 0 for n in xrange(100)])
+        self.assertTrue(max(started) > 0)  # calls ran while items were still produced
+
+
+class UploadTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(error_rate=0.5).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_upload_metrics_endpoints(self):
+        self.server.error_rate = 0
+        metrics = pb.MetricsAggregator()
+        api = self.server.api(hooks=[metrics])
+        for n in xrange(10):
+            pb.FilePush(buffer('x' * 100), file_name='file%d.txt' % n, file_type='text/plain').upload(api)
+        self.assertEqual(sorted(metrics.snapshot()), ['GET 127.0.0.1/v2/upload-request', 'POST 127.0.0.1/upload/*'])
+        self.assertEqual(pb.Session.endpoint('/upload-legacy/key/file.txt'), '/upload-legacy/*/*')
+        self.assertEqual(pb.Session.endpoint('/v2/pushes/iden'), '/v2/pushes/*')
+
+    def test_upload_cache_per_account(self):
+        self.server.error_rate = 0
+        path = os.path.join(tempfile.mkdtemp(), 'uploads.json')
+        for apikey, uploaded in (('key1', True), ('key1', False), ('key2', True)):
+            api = self.server.api(apikey, upload_cache=pb.UploadCache(path))
+            before = self.server.state.uploaded
+            pb.FilePush(buffer('x' * 100), file_name='file.txt', file_type='text/plain').upload(api)
+            self.assertEqual(self.server.state.uploaded > before, uploaded, apikey)
+
+    def test_upload_retried(self):
+        api = self.server.api(retry=pb.RetryPolicy(total=30, backoff=0.001))
+        for n in xrange(10):
+            push = pb.FilePush(buffer('x' * 1000), file_name='file%d.txt' % n, file_type='text/plain')
+            push.upload(api)
+            self.assertTrue(push.file_url)
+
+
+class PushStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_float_cursor_round_trip(self):
+        # pushes modified within milliseconds after `modified_after` cursor must not be skipped
+        api = self.server.api()
+        store = pb.PushStore(api)
+        for n in xrange(200):
+            self.server.state.add_push({'type': 'note', 'body': 'note #%d' % n})
+            if n % 2:
+                store.sync()
+
+        self.assertEqual(len(store), 200)
+
+
+class StreamTest(unittest.TestCase):
+    END = {'type': 'push', 'push': {'type': 'mirror', 'body': 'END'}}
+    TICKLES = 200
+
+    def setUp(self):
+        self.server = FakeServer().start()
+        frames = [{'type': 'tickle', 'subtype': 'push'}] * self.TICKLES + [self.END]
+        self.stream = FakeStream(frames, rate=2000, burst=5, state=self.server.state, heartbeat=0.1).start()
+
+    def tearDown(self):
+        self.stream.stop()
+        self.server.stop()
+
+    def api(self):
+        api = self.server.api()
+        api.STREAM_URL = self.stream.stream_url
+        return api
+
+    def delivered(self, events, wait=0):
+        # pushes fetched in background (by multiplexer) can be yielded after END push event
+        idens, deadline = [], None
+        for event in events:
+            if isinstance(event, pb.PushEvent) and event.push.get('body') == 'END':
+                deadline = time.time() + wait
+            elif isinstance(event, pb.TickleEvent):
+                idens.extend(p.iden for p in event.pushes())
+
+            if deadline is not None and (time.time() >= deadline or
+                                         len(set(idens)) >= len(self.server.state.pushes)):
+                return idens
+
+    def all_pushes(self):
+        return sorted(p['iden'] for p in self.server.state.pushes)
+
+    def test_tickled_pushes_delivered(self):
+        idens = self.delivered(self.api().stream(throttle=0))
+        self.assertEqual(sorted(set(idens)), self.all_pushes())
+
+    def test_coalesced_pushes_delivered_once(self):
+        idens = self.delivered(self.api().stream(coalesce=0.02))
+        self.assertEqual(sorted(idens), self.all_pushes())
+
+    def test_multiplexer(self):
+        mux = pb.StreamMultiplexer([self.api()], workers=2, skip_nop=False, coalesce=0.02)
+        try:
+            idens = self.delivered((event for _, event in mux), wait=5)
+        finally:
+            mux.close()
+        self.assertEqual(sorted(idens), self.all_pushes())
+
+if __name__ == '__main__':
+    unittest.main()